@@ -1,31 +1,90 @@
 import dash
-from dash import dcc, html, Input, Output, callback_context
+import flask
+from dash import dcc, html, Input, Output, State, ClientsideFunction, Patch, callback_context
 import pandas as pd
 import plotly.express as px
-import plotly.graph_objects as go
 from dash.exceptions import PreventUpdate
 import numpy as np
+import plotly.io as pio
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as TiempoAgotado
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+try:
+    import brotli
+except ImportError:  # Sin brotli las respuestas se comprimen solo con gzip
+    brotli = None
+import gzip
+
+# Función para obtener el índice de mes (meses desde 1970-01) a partir de año y mes
+# enteros. Devuelve también la máscara de combinaciones válidas (mes entre 1 y 12).
+def indice_mes(anio, mes):
+    anio = pd.to_numeric(pd.Series(anio), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    mes = pd.to_numeric(pd.Series(mes), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    validos = np.isfinite(anio) & np.isfinite(mes) & (mes >= 1) & (mes <= 12) & (mes == np.floor(mes))
+    indice = np.where(validos, (anio - 1970) * 12 + (mes - 1), 0).astype('int64')
+    return indice, validos
+
+# Función para construir la fecha (día 1 del mes) sin pasar por cadenas de texto
+def fecha_desde_anio_mes(anio, mes):
+    indice, validos = indice_mes(anio, mes)
+    fechas = indice.astype('datetime64[M]').astype('datetime64[ns]')
+    fechas[~validos] = np.datetime64('NaT')
+    return fechas
 
-# Función para preprocesar datos
-def preprocesar_datos(df):
-    # Copia para evitar modificar el original
-    df_procesado = df.copy()
+# Función para calcular el trimestre directamente desde el mes entero
+def trimestre_desde_mes(anio, mes):
+    indice, validos = indice_mes(anio, mes)
+    trimestre = (indice % 12) // 3 + 1
+    if validos.all():
+        return trimestre.astype('int8')
+    return np.where(validos, trimestre, np.nan)
+
+# Función para preprocesar datos. Con fechas=False no se derivan
+# FECHA_INSTALACION ni TRIMESTRE: el cubo solo usa año y mes, y así cada
+# worker no arma esos arreglos privados del largo del dataset.
+def preprocesar_datos(df, fechas=True):
+    # Copia superficial: solo se agregan o reemplazan columnas, así que no hace
+    # falta duplicar los datos (y se conservan las columnas mapeadas en memoria)
+    df_procesado = df.copy(deep=False)
     
-    # Asegurar tipos de datos correctos
-    if 'ANIO_INSTALACION' in df_procesado.columns:
-        df_procesado['ANIO_INSTALACION'] = df_procesado['ANIO_INSTALACION'].astype(int)
+    # Departamento, municipio y tipo como categorías: los filtros y conteos
+    # trabajan sobre códigos enteros y no sobre comparaciones de texto
+    for col in ['DEPARTAMENTO_INSTALACION', 'MUNICIPIO_INSTALACION', 'TIPO_VEHICULO']:
+        if col in df_procesado.columns and not isinstance(df_procesado[col].dtype, pd.CategoricalDtype):
+            df_procesado[col] = df_procesado[col].astype('category')
+
+    # Asegurar tipos de datos correctos (la ingesta columnar ya entrega enteros pequeños).
+    # Año y mes faltantes o inválidos quedan como NA, igual que en el almacén columnar.
+    for col, tipo in columnas_enteras.items():
+        if col in df_procesado.columns and not pd.api.types.is_integer_dtype(df_procesado[col]):
+            valores = entero_sin_faltantes(df_procesado[col], tipo)
+            df_procesado[col] = pd.arrays.IntegerArray(valores, valores == 0)
     
+    if not fechas:
+        return df_procesado
+
     # Creamos columna de fecha completa si no existe
     if 'FECHA_INSTALACION' not in df_procesado.columns and 'MES_INSTALACION' in df_procesado.columns:
         try:
-            df_procesado['FECHA_INSTALACION'] = pd.to_datetime(
-                df_procesado['ANIO_INSTALACION'].astype(str) + '-' + 
-                df_procesado['MES_INSTALACION'].astype(str) + '-01',
-                errors='coerce'  # Ignora errores en conversión
+            # Aritmética vectorizada sobre año y mes enteros (los meses inválidos quedan como NaT)
+            df_procesado['FECHA_INSTALACION'] = fecha_desde_anio_mes(
+                df_procesado['ANIO_INSTALACION'], df_procesado['MES_INSTALACION']
+            )
+            df_procesado['TRIMESTRE'] = trimestre_desde_mes(
+                df_procesado['ANIO_INSTALACION'], df_procesado['MES_INSTALACION']
             )
-            
-            # Agregamos columna de trimestre solo si la fecha se creó correctamente
-            df_procesado['TRIMESTRE'] = df_procesado['FECHA_INSTALACION'].dt.quarter
         except Exception as e:
             print(f"No se pudo crear la columna de fecha: {e}")
     elif 'FECHA_INSTALACION' in df_procesado.columns:
@@ -42,58 +101,805 @@ def preprocesar_datos(df):
     
     return df_procesado
 
-# Cargar tu archivo CSV o el dataframe base antes de procesarlo
-df = pd.read_csv('Database.csv')
-  # Ajusta el nombre del archivo
-df = preprocesar_datos(df)
+# ========== INGESTA COLUMNAR ==========
+# El CSV se convierte una sola vez a un directorio de arreglos NumPy tipados
+# (códigos categóricos para textos, enteros pequeños para año y mes). Los
+# arranques siguientes leen esos arreglos directamente y solo se reconstruyen
+# cuando cambia el CSV (mtime y, si difiere, su hash).
+RUTA_CSV = os.environ.get('GNCV_CSV', 'Database.csv')
+DIRECTORIO_COLUMNAR = os.environ.get('GNCV_COLUMNAR_DIR', '.gncv_columnar')
+VERSION_FORMATO_COLUMNAR = 1
+
+columnas_categoricas = ['DEPARTAMENTO_INSTALACION', 'MUNICIPIO_INSTALACION', 'TIPO_VEHICULO']
+columnas_enteras = {'ANIO_INSTALACION': 'int16', 'MES_INSTALACION': 'int8'}
+columnas_reales = {'LATITUD_MUNICIPIO': 'float32', 'LONGITUD_MUNICIPIO': 'float32'}
+columnas_fecha = ['FECHA_INSTALACION']
+columnas_ingesta = columnas_categoricas + list(columnas_enteras) + list(columnas_reales) + columnas_fecha
+
+# Función para calcular el hash del CSV por bloques
+def hash_archivo(ruta, tamano_bloque=1 << 20):
+    h = hashlib.sha1()
+    with open(ruta, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(tamano_bloque), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+# Función que lee los metadatos del almacén columnar (None si no existe o está dañado)
+def leer_meta_columnar(directorio):
+    try:
+        with open(os.path.join(directorio, 'meta.json'), encoding='utf-8') as archivo:
+            meta = json.load(archivo)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != VERSION_FORMATO_COLUMNAR:
+        return None
+    return meta
+
+# Función que decide si el almacén columnar sigue correspondiendo al CSV
+def columnar_vigente(meta, ruta_csv):
+    if meta is None:
+        return False
+    if not os.path.exists(ruta_csv):
+        # Sin CSV (p. ej. despliegue solo con el almacén) se usa lo que haya
+        return True
+    estado = os.stat(ruta_csv)
+    if meta['origen']['mtime_ns'] == estado.st_mtime_ns and meta['origen']['tamano'] == estado.st_size:
+        return True
+    # El mtime cambió pero el contenido puede ser el mismo (copia, touch)
+    return meta['origen']['tamano'] == estado.st_size and meta['origen']['sha1'] == hash_archivo(ruta_csv)
+
+# Función que lee del CSV solo las columnas que usa el dashboard
+def leer_csv_crudo(fuente):
+    return pd.read_csv(
+        fuente,
+        usecols=lambda col: col in columnas_ingesta,
+        dtype={col: 'category' for col in columnas_categoricas}
+    )
+
+# Función que convierte el CSV al almacén columnar
+def construir_columnar(ruta_csv, directorio):
+    estado = os.stat(ruta_csv)
+    crudo = leer_csv_crudo(ruta_csv)
 
-# Procesamos el dataframe (asumiendo que df ya está definido)
+    meta = {
+        'version': VERSION_FORMATO_COLUMNAR,
+        'origen': {'mtime_ns': estado.st_mtime_ns, 'tamano': estado.st_size, 'sha1': hash_archivo(ruta_csv)},
+        'filas': len(crudo),
+        'columnas': {}
+    }
+    arreglos = {}
+    for col in crudo.columns:
+        if col in columnas_categoricas:
+            categorias = crudo[col].cat.categories
+            arreglos[col] = crudo[col].cat.codes.to_numpy()
+            meta['columnas'][col] = {'tipo': 'categoria', 'categorias': categorias.astype(str).tolist()}
+        elif col in columnas_enteras:
+            arreglos[col] = entero_sin_faltantes(crudo[col], columnas_enteras[col])
+            meta['columnas'][col] = {'tipo': 'entero', 'faltantes': bool((arreglos[col] == 0).any())}
+        elif col in columnas_reales:
+            arreglos[col] = pd.to_numeric(crudo[col], errors='coerce').to_numpy().astype(columnas_reales[col])
+            meta['columnas'][col] = {'tipo': 'real'}
+        else:
+            arreglos[col] = pd.to_datetime(crudo[col], errors='coerce').to_numpy().astype('datetime64[ns]')
+            meta['columnas'][col] = {'tipo': 'fecha'}
+
+    # Se escribe en un directorio temporal y se intercambia al final
+    directorio_tmp = tempfile.mkdtemp(prefix='.gncv_tmp_', dir=os.path.dirname(os.path.abspath(directorio)))
+    os.chmod(directorio_tmp, 0o755)
+    for col, valores in arreglos.items():
+        np.save(os.path.join(directorio_tmp, f'{col}.npy'), valores)
+    with open(os.path.join(directorio_tmp, 'meta.json'), 'w', encoding='utf-8') as archivo:
+        json.dump(meta, archivo, ensure_ascii=False)
+    if os.path.exists(directorio):
+        shutil.rmtree(directorio)
+    os.replace(directorio_tmp, directorio)
+    return meta
+
+# Función para convertir año o mes a enteros pequeños. Los faltantes se
+# guardan como 0 (no hay año ni mes 0) y se exponen luego como NA.
+def entero_sin_faltantes(serie, tipo):
+    return pd.to_numeric(serie, errors='coerce').fillna(0).to_numpy().astype(tipo)
+
+# Función que arma el dataframe desde el almacén columnar. Los arreglos se
+# abren como memoria mapeada de solo lectura: todos los workers de gunicorn
+# comparten las mismas páginas del caché del sistema operativo en lugar de
+# tener cada uno su copia privada del dataset.
+def leer_columnar(directorio, meta):
+    columnas = {}
+    for col, info in meta['columnas'].items():
+        valores = np.load(os.path.join(directorio, f'{col}.npy'), mmap_mode='r')
+        if info['tipo'] == 'categoria':
+            columnas[col] = pd.Categorical.from_codes(valores, categories=info['categorias'])
+        elif info['tipo'] == 'entero' and info['faltantes']:
+            columnas[col] = pd.arrays.IntegerArray(valores, valores == 0)
+        else:
+            columnas[col] = valores
+    # copy=False para que las columnas sigan siendo vistas sobre el mapeo
+    return pd.DataFrame(columnas, copy=False)
+
+# Función de carga: reconstruye el almacén si hace falta y lo lee
+def cargar_datos(ruta_csv, directorio=DIRECTORIO_COLUMNAR):
+    meta = leer_meta_columnar(directorio)
+    if not columnar_vigente(meta, ruta_csv):
+        # Un solo proceso convierte; los demás workers esperan y reutilizan el resultado
+        with open(f'{directorio}.lock', 'w') as candado:
+            if fcntl is not None:
+                fcntl.flock(candado, fcntl.LOCK_EX)
+            meta = leer_meta_columnar(directorio)
+            if not columnar_vigente(meta, ruta_csv):
+                print(f"Construyendo almacén columnar desde {ruta_csv}...")
+                meta = construir_columnar(ruta_csv, directorio)
+    return leer_columnar(directorio, meta), meta['origen']
+
+# Cargar el dataset (desde el almacén columnar) y preprocesarlo una sola vez
+origen_datos = None
 try:
-    df = preprocesar_datos(df)
-except NameError:
-    # Si df no está definido, mostrar un mensaje de error
-    print("Error: El dataframe 'df' no está definido. Por favor, define el dataframe antes de ejecutar este código.")
-    # Podemos crear un dataframe de ejemplo para propósitos de demostración
+    df, origen_datos = cargar_datos(RUTA_CSV)
+except FileNotFoundError:
+    # Si no hay CSV ni almacén columnar, mostrar un mensaje de error
+    print(f"Error: no se encontró '{RUTA_CSV}'. Se usará un dataframe de ejemplo para propósitos de demostración.")
     df = pd.DataFrame({
         'DEPARTAMENTO_INSTALACION': ['Antioquia', 'Bogotá', 'Valle del Cauca'] * 10,
         'MUNICIPIO_INSTALACION': ['Medellín', 'Bogotá', 'Cali'] * 10,
         'ANIO_INSTALACION': [2020, 2021, 2022] * 10,
-        'MES_INSTALACION': list(range(1, 13)) + list(range(1, 13)) + list(range(1, 5)),
+        'MES_INSTALACION': list(range(1, 13)) + list(range(1, 13)) + list(range(1, 7)),
         'LATITUD_MUNICIPIO': [6.2518, 4.6097, 3.4516] * 10,
         'LONGITUD_MUNICIPIO': [-75.5636, -74.0817, -76.5320] * 10
     })
-    df = preprocesar_datos(df)
+df = preprocesar_datos(df, fechas=False)
+
+# ========== CUBO DE AGREGADOS ==========
+# Conteos precalculados una sola vez por (año, departamento, municipio, mes).
+# Los callbacks cortan este cubo en lugar de copiar y filtrar df completo,
+# así su costo depende del número de grupos y no del número de filas.
+dimensiones_cubo = ['ANIO_INSTALACION', 'DEPARTAMENTO_INSTALACION', 'MUNICIPIO_INSTALACION', 'MES_INSTALACION']
+if 'TIPO_VEHICULO' in df.columns:
+    dimensiones_cubo.append('TIPO_VEHICULO')
+
+# Función para construir el cubo de conteos a partir del dataframe procesado.
+# El cubo queda ordenado por año y departamento para que cada combinación sea
+# un bloque contiguo de filas.
+def construir_cubo(df, dimensiones):
+    # dropna=False para no perder filas con municipio o mes faltante en los totales
+    cubo = df.groupby(dimensiones, dropna=False, observed=True).size().reset_index(name='CONVERSIONES')
+    return cubo.sort_values(dimensiones, kind='stable', ignore_index=True)
+
+# Función para construir el índice invertido del cubo: cada año, departamento y
+# (año, departamento) apunta directamente a sus filas, de modo que filtrar es
+# una búsqueda en un diccionario y no un recorrido de columnas completas
+def construir_indice_cubo(cubo):
+    anios_cubo = cubo['ANIO_INSTALACION'].to_numpy(dtype='float64', na_value=np.nan)
+    codigos_dep = cubo['DEPARTAMENTO_INSTALACION'].cat.codes.to_numpy()
+    categorias_dep = cubo['DEPARTAMENTO_INSTALACION'].cat.categories
+
+    # Límites de los bloques contiguos (año, departamento)
+    cambios = np.flatnonzero((np.diff(anios_cubo) != 0) | (np.diff(codigos_dep) != 0)) + 1
+    inicios = np.concatenate([[0], cambios])
+    finales = np.concatenate([cambios, [len(cubo)]])
+
+    indice = {'anio': {}, 'departamento': {}, 'anio_departamento': {}}
+    posiciones_dep = {}
+    for inicio, fin in zip(inicios.tolist(), finales.tolist()):
+        if inicio == fin or np.isnan(anios_cubo[inicio]) or codigos_dep[inicio] < 0:
+            continue
+        anio = int(anios_cubo[inicio])
+        departamento = categorias_dep[codigos_dep[inicio]]
+        indice['anio_departamento'][(anio, departamento)] = slice(inicio, fin)
+        bloque_anio = indice['anio'].get(anio)
+        indice['anio'][anio] = slice(inicio if bloque_anio is None else bloque_anio.start, fin)
+        posiciones_dep.setdefault(departamento, []).append(np.arange(inicio, fin))
+    indice['departamento'] = {dep: np.concatenate(bloques) for dep, bloques in posiciones_dep.items()}
+    return indice
+
+# Función para obtener la porción del cubo que corresponde a los filtros
+def filtrar_cubo(cubo, indice, anio, departamento):
+    filtra_anio = bool(anio) and anio != 'todos'
+    filtra_dep = bool(departamento) and departamento != 'todos'
+    if filtra_anio and filtra_dep:
+        posiciones = indice['anio_departamento'].get((int(anio), departamento), slice(0, 0))
+    elif filtra_anio:
+        posiciones = indice['anio'].get(int(anio), slice(0, 0))
+    elif filtra_dep:
+        posiciones = indice['departamento'].get(departamento, slice(0, 0))
+    else:
+        return cubo
+    return cubo.iloc[posiciones]
+
+# Función para obtener los municipios con más conversiones con un bincount sobre los códigos
+def top_municipios(cubo_filtrado, n=10):
+    municipios = cubo_filtrado['MUNICIPIO_INSTALACION']
+    codigos = municipios.cat.codes.to_numpy()
+    conteos = cubo_filtrado['CONVERSIONES'].to_numpy()
+    validos = codigos >= 0
+    totales = np.bincount(codigos[validos], weights=conteos[validos], minlength=len(municipios.cat.categories))
+    orden = np.argsort(-totales, kind='stable')[:n]
+    orden = orden[totales[orden] > 0]
+    return pd.Series(totales[orden].astype('int64'), index=municipios.cat.categories[orden].rename('MUNICIPIO_INSTALACION'))
+
+# Función para sumar en un solo cubo los conteos de varios cubos (p. ej. datos nuevos)
+def combinar_cubos(cubos, dimensiones):
+    combinado = pd.concat(cubos, ignore_index=True)
+    combinado = normalizar_categorias(combinado, dimensiones)
+    combinado = combinado.groupby(dimensiones, dropna=False, observed=True)['CONVERSIONES'].sum().reset_index()
+    return combinado.sort_values(dimensiones, kind='stable', ignore_index=True)
+
+# Función para unificar las categorías de columnas que vienen de fuentes distintas
+def normalizar_categorias(tabla, columnas):
+    for col in columnas_categoricas:
+        if col in columnas and col in tabla.columns:
+            tabla[col] = tabla[col].astype(object).astype('category')
+    return tabla
+
+# ========== AGREGADOS DEL MAPA ==========
+# Conteos por (año, departamento, municipio) con sus coordenadas, calculados
+# una vez desde el cubo. Cada filtro del mapa es un corte de esta tabla, con
+# burbujas del tamaño de las conversiones del año filtrado.
+columnas_mpio = ['DEPARTAMENTO_INSTALACION', 'MUNICIPIO_INSTALACION']
+columnas_coordenadas = ['LATITUD_MUNICIPIO', 'LONGITUD_MUNICIPIO']
+
+# Función para obtener las coordenadas de cada municipio (primer registro, como antes)
+def construir_coordenadas(df):
+    if not all(col in df.columns for col in columnas_coordenadas):
+        return None
+    return df.groupby(columnas_mpio, observed=True)[columnas_coordenadas].first().reset_index()
+
+# Función para construir la tabla del mapa por año, indexada igual que el cubo
+def construir_cubo_mapa(cubo, coordenadas):
+    cubo_mapa = (
+        cubo.groupby(['ANIO_INSTALACION'] + columnas_mpio, observed=True)['CONVERSIONES']
+        .sum()
+        .reset_index(name='TOTAL_CONVERSIONES')
+        .merge(coordenadas, on=columnas_mpio, how='inner')
+    )
+    cubo_mapa = normalizar_categorias(cubo_mapa, columnas_mpio)
+    return cubo_mapa.sort_values(['ANIO_INSTALACION'] + columnas_mpio, kind='stable', ignore_index=True)
+
+# Función para sumar varios años en una fila por municipio
+def sumar_por_municipio(porcion_mapa):
+    return (
+        porcion_mapa.groupby(columnas_mpio, observed=True, sort=True)
+        .agg(TOTAL_CONVERSIONES=('TOTAL_CONVERSIONES', 'sum'),
+             LATITUD_MUNICIPIO=('LATITUD_MUNICIPIO', 'first'),
+             LONGITUD_MUNICIPIO=('LONGITUD_MUNICIPIO', 'first'))
+        .reset_index()
+    )
+
+# Función para combinar coordenadas conocidas con las de municipios nuevos
+def combinar_coordenadas(coordenadas, coordenadas_nuevas):
+    if coordenadas is None or coordenadas_nuevas is None:
+        return coordenadas if coordenadas_nuevas is None else coordenadas_nuevas
+    combinadas = pd.concat([coordenadas, coordenadas_nuevas], ignore_index=True)
+    combinadas = normalizar_categorias(combinadas, columnas_mpio)
+    # Se conserva la primera coordenada vista de cada municipio
+    return combinadas.drop_duplicates(subset=columnas_mpio, keep='first', ignore_index=True)
+
+# Función para obtener los puntos del mapa que corresponden a los filtros
+def agregar_mapa(estado, anio, departamento):
+    filtra_anio = bool(anio) and anio != 'todos'
+    filtra_dep = bool(departamento) and departamento != 'todos'
+    if not filtra_anio and not filtra_dep:
+        return estado['mapa_nacional']
+    porcion = filtrar_cubo(estado['cubo_mapa'], estado['indice_mapa'], anio, departamento)
+    if filtra_anio:
+        # Con año fijo ya hay una fila por municipio
+        return porcion
+    return sumar_por_municipio(porcion)
+
+# Nivel de detalle del mapa: a escala nacional se dibuja una burbuja por
+# departamento (en el centroide de sus municipios) y los municipios solo
+# aparecen al elegir un departamento o al acercar el mapa hasta GNCV_ZOOM_DETALLE
+ZOOM_DETALLE = float(os.environ.get('GNCV_ZOOM_DETALLE', 6))
+
+# Función para el centroide de cada departamento, indexado por código de categoría
+def construir_centroides(mapa_nacional):
+    departamentos = mapa_nacional['DEPARTAMENTO_INSTALACION']
+    codigos = departamentos.cat.codes.to_numpy()
+    validos = codigos >= 0
+    n = len(departamentos.cat.categories)
+    cantidad = np.bincount(codigos[validos], minlength=n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            col: np.bincount(codigos[validos], weights=mapa_nacional[col].to_numpy(dtype='float64')[validos], minlength=n) / cantidad
+            for col in columnas_coordenadas
+        }
+
+# Función para decidir el nivel de detalle según el filtro de departamento y el zoom
+def nivel_mapa(departamento, zoom=None):
+    if (departamento and departamento != 'todos') or (zoom is not None and zoom >= ZOOM_DETALLE):
+        return 'municipios'
+    return 'departamentos'
+
+# Función para el nivel de detalle de una consulta con filtros de detalle
+def nivel_consulta(consulta, zoom=None):
+    if consulta['departamentos'] or consulta['municipios']:
+        return 'municipios'
+    return nivel_mapa('todos', zoom)
+
+# Función para obtener los puntos del mapa en el nivel pedido como arreglos
+def puntos_mapa(estado, anio, departamento, nivel):
+    return puntos_desde_tabla(estado, agregar_mapa(estado, anio, departamento), nivel)
+
+# Función para obtener la tabla del mapa (una fila por municipio) de una porción cualquiera del cubo
+def tabla_mapa_consulta(estado, cubo_filtrado):
+    tabla = (
+        cubo_filtrado.groupby(columnas_mpio, observed=True)['CONVERSIONES']
+        .sum()
+        .reset_index(name='TOTAL_CONVERSIONES')
+        .astype({col: object for col in columnas_mpio})
+        .merge(estado['coordenadas'].astype({col: object for col in columnas_mpio}), on=columnas_mpio, how='inner')
+    )
+    # Mismas categorías que la tabla del mapa, para que colores y centroides coincidan
+    categorias = estado['cubo_mapa']['DEPARTAMENTO_INSTALACION'].cat.categories
+    tabla['DEPARTAMENTO_INSTALACION'] = pd.Categorical(tabla['DEPARTAMENTO_INSTALACION'], categories=categorias)
+    return tabla.sort_values(columnas_mpio, kind='stable', ignore_index=True)
+
+# Función para convertir la tabla del mapa en los arreglos del nivel pedido
+def puntos_desde_tabla(estado, tabla, nivel):
+    departamentos = tabla['DEPARTAMENTO_INSTALACION']
+    if nivel == 'municipios':
+        return {
+            'lat': tabla['LATITUD_MUNICIPIO'].to_numpy(),
+            'lon': tabla['LONGITUD_MUNICIPIO'].to_numpy(),
+            'total': tabla['TOTAL_CONVERSIONES'].to_numpy(),
+            'nombre': tabla['MUNICIPIO_INSTALACION'].to_numpy(dtype=object),
+            'departamento': departamentos.to_numpy(dtype=object),
+            'codigo': departamentos.cat.codes.to_numpy()
+        }
+    codigos = departamentos.cat.codes.to_numpy()
+    validos = codigos >= 0
+    totales = np.bincount(codigos[validos], weights=tabla['TOTAL_CONVERSIONES'].to_numpy()[validos],
+                          minlength=len(departamentos.cat.categories))
+    centroides = estado['centroides']
+    seleccion = np.flatnonzero((totales > 0) & np.isfinite(centroides['LATITUD_MUNICIPIO']))
+    nombres = departamentos.cat.categories.to_numpy(dtype=object)[seleccion]
+    return {
+        'lat': centroides['LATITUD_MUNICIPIO'][seleccion],
+        'lon': centroides['LONGITUD_MUNICIPIO'][seleccion],
+        'total': totales[seleccion].astype('int64'),
+        'nombre': nombres,
+        'departamento': nombres,
+        'codigo': seleccion
+    }
+
+# ========== SERIES DE TIEMPO ==========
+# Series mensuales densas (un valor por mes, con ceros donde no hubo
+# conversiones) por departamento y para el total nacional, con sus promedios
+# móviles y la variación anual ya calculados. El filtro de año es un corte de
+# columnas, así la tendencia no hace trabajo de pandas por request.
+# GNCV_VENTANAS_MOVILES agrega ventanas al promedio de 3 meses, p. ej. "6,12".
+VENTANAS_MOVILES = sorted({3} | {int(v) for v in os.environ.get('GNCV_VENTANAS_MOVILES', '').split(',') if v.strip()})
+
+# Función para el promedio móvil de cada fila de una matriz (NaN en los primeros ventana-1 meses)
+def promedio_movil(matriz, ventana):
+    acumulado = np.zeros((matriz.shape[0], matriz.shape[1] + 1))
+    np.cumsum(matriz, axis=1, out=acumulado[:, 1:])
+    promedio = np.full(matriz.shape, np.nan)
+    if matriz.shape[1] >= ventana:
+        promedio[:, ventana - 1:] = (acumulado[:, ventana:] - acumulado[:, :-ventana]) / ventana
+    return promedio
+
+# Función para la variación porcentual frente al mismo mes del año anterior
+def variacion_anual(matriz):
+    variacion = np.full(matriz.shape, np.nan)
+    anterior = matriz[:, :-12]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variacion[:, 12:] = np.where(anterior > 0, matriz[:, 12:] / anterior - 1, np.nan)
+    return variacion
+
+# Función para construir las series a partir del cubo. La fila 0 es el total
+# nacional y la fila i+1 el departamento i de las categorías del cubo.
+def construir_series(cubo, ventanas=VENTANAS_MOVILES):
+    indice, validos = indice_mes(cubo['ANIO_INSTALACION'], cubo['MES_INSTALACION'])
+    if not validos.any():
+        return None
+    departamentos = cubo['DEPARTAMENTO_INSTALACION'].cat.categories
+    filas = cubo['DEPARTAMENTO_INSTALACION'].cat.codes.to_numpy()[validos].astype('int64') + 1
+    inicio = int(indice[validos].min())
+    columnas = indice[validos] - inicio
+    n_meses = int(columnas.max()) + 1
+    n_filas = len(departamentos) + 1
+    conteos = np.bincount(filas * n_meses + columnas, weights=cubo['CONVERSIONES'].to_numpy()[validos],
+                          minlength=n_filas * n_meses).reshape(n_filas, n_meses)
+    # Las filas sin departamento quedan en la fila 0 y solo cuentan en el total
+    conteos[0] = conteos.sum(axis=0)
+    return {
+        'inicio': inicio,
+        'fechas': np.arange(inicio, inicio + n_meses).astype('datetime64[M]').astype('datetime64[ns]'),
+        'filas': {departamento: i + 1 for i, departamento in enumerate(departamentos)},
+        'conteos': conteos.astype('int64'),
+        'promedios': {ventana: promedio_movil(conteos, ventana) for ventana in ventanas},
+        'variacion_anual': variacion_anual(conteos)
+    }
+
+# Función para obtener el corte de la serie que corresponde a los filtros: la
+# fila del departamento (o nacional) y las columnas del año, recortando los
+# meses sin datos de los extremos
+def cortar_serie(series, anio, departamento):
+    if series is None:
+        return None, slice(0, 0)
+    fila = 0
+    if departamento and departamento != 'todos':
+        fila = series['filas'].get(departamento)
+        if fila is None:
+            return None, slice(0, 0)
+    n_meses = series['conteos'].shape[1]
+    inicio, fin = 0, n_meses
+    if anio and anio != 'todos':
+        primer_mes = (int(anio) - 1970) * 12 - series['inicio']
+        inicio, fin = np.clip([primer_mes, primer_mes + 12], 0, n_meses).tolist()
+    con_datos = np.flatnonzero(series['conteos'][fila, inicio:fin])
+    if len(con_datos) == 0:
+        return None, slice(0, 0)
+    return fila, slice(inicio + int(con_datos[0]), inicio + int(con_datos[-1]) + 1)
+
+# ========== ÍNDICE DE BITMAPS ==========
+# Filtros de detalle (varios departamentos, municipios, rango de meses y tipo
+# de vehículo) sobre las filas del cubo. Cada valor de año, departamento, mes y
+# tipo tiene un bitmap empaquetado en palabras de 64 bits; los municipios, que
+# son muchos, guardan la lista ordenada de sus filas y se convierten a bitmap
+# al consultarlos. Una consulta une (OR) los valores elegidos de cada filtro e
+# intersecta (AND) los filtros entre sí.
+SEPARADOR_MUNICIPIO = '|'
+columnas_bitmap = {
+    'anio': 'ANIO_INSTALACION',
+    'departamento': 'DEPARTAMENTO_INSTALACION',
+    'mes': 'MES_INSTALACION',
+    'tipo': 'TIPO_VEHICULO'
+}
+
+class IndiceBitmap:
+    def __init__(self, cubo):
+        self.filas = len(cubo)
+        self.bitmaps = {}
+        for dimension, columna in columnas_bitmap.items():
+            if columna not in cubo.columns:
+                continue
+            codigos, valores = pd.factorize(cubo[columna], sort=True)
+            self.bitmaps[dimension] = {
+                int(valor) if isinstance(valor, (int, np.integer)) else valor: self._empaquetar(codigos == i)
+                for i, valor in enumerate(valores)
+            }
+
+        # Filas de cada municipio, identificado como "DEPARTAMENTO|MUNICIPIO"
+        claves = (cubo['DEPARTAMENTO_INSTALACION'].astype(object) + SEPARADOR_MUNICIPIO
+                  + cubo['MUNICIPIO_INSTALACION'].astype(object))
+        codigos, valores = pd.factorize(claves, sort=True)
+        orden = np.argsort(codigos, kind='stable')
+        cortes = np.flatnonzero(np.diff(codigos[orden])) + 1
+        self.posiciones_municipio = {}
+        for posiciones in np.split(orden, cortes):
+            if len(posiciones) and codigos[posiciones[0]] >= 0:
+                self.posiciones_municipio[valores[codigos[posiciones[0]]]] = posiciones
+
+    # Función para empaquetar una máscara booleana en palabras de 64 bits
+    def _empaquetar(self, mascara):
+        bytes_ = np.packbits(mascara, bitorder='little')
+        relleno = (-len(bytes_)) % 8
+        return np.concatenate([bytes_, np.zeros(relleno, dtype='uint8')]).view('<u8')
+
+    def _union(self, dimension, valores):
+        resultado = np.zeros((self.filas + 63) // 64, dtype='<u8')
+        for valor in valores:
+            bitmap = self.bitmaps.get(dimension, {}).get(valor)
+            if bitmap is not None:
+                resultado |= bitmap
+        return resultado
+
+    def _municipios(self, claves):
+        mascara = np.zeros(self.filas, dtype=bool)
+        for clave in claves:
+            posiciones = self.posiciones_municipio.get(clave)
+            if posiciones is not None:
+                mascara[posiciones] = True
+        return self._empaquetar(mascara)
+
+    # Devuelve las posiciones (ordenadas) de las filas del cubo que cumplen la consulta
+    def filtrar(self, consulta):
+        restricciones = []
+        if consulta['anio'] != 'todos':
+            restricciones.append(self._union('anio', [int(consulta['anio'])]))
+        if consulta['departamentos']:
+            restricciones.append(self._union('departamento', consulta['departamentos']))
+        if consulta['municipios']:
+            restricciones.append(self._municipios(consulta['municipios']))
+        if consulta['meses']:
+            restricciones.append(self._union('mes', range(consulta['meses'][0], consulta['meses'][1] + 1)))
+        if consulta['tipos']:
+            restricciones.append(self._union('tipo', consulta['tipos']))
+        if not restricciones:
+            return np.arange(self.filas)
+        resultado = restricciones[0].copy()
+        for bitmap in restricciones[1:]:
+            resultado &= bitmap
+        return np.flatnonzero(np.unpackbits(resultado.view('uint8'), count=self.filas, bitorder='little'))
+
+# Función para llevar los valores de los controles a una consulta canónica
+# (tuplas ordenadas, sin 'todos'; meses en None si cubren el año completo)
+def normalizar_consulta(anio, departamentos, municipios=None, meses=None, tipos=None):
+    def valores(valor):
+        if valor is None or valor == '' or valor == 'todos':
+            return ()
+        if isinstance(valor, str):
+            return (valor,)
+        if 'todos' in valor:
+            return ()
+        return tuple(sorted(valor))
+    rango = None
+    if meses and (int(meses[0]) > 1 or int(meses[1]) < 12):
+        rango = (int(meses[0]), int(meses[1]))
+    return {
+        'anio': anio if anio not in (None, '') else 'todos',
+        'departamentos': valores(departamentos),
+        'municipios': valores(municipios),
+        'meses': rango,
+        'tipos': valores(tipos)
+    }
+
+# Función que indica si la consulta se resuelve con los cortes precalculados (año y un departamento)
+def es_consulta_simple(consulta):
+    return len(consulta['departamentos']) <= 1 and not consulta['municipios'] and not consulta['meses'] and not consulta['tipos']
+
+# Función con el texto de departamento (o municipios) que usan los títulos y el zoom del mapa
+def departamento_consulta(consulta):
+    if consulta['municipios']:
+        return ', '.join(clave.split(SEPARADOR_MUNICIPIO, 1)[1] for clave in consulta['municipios'])
+    if consulta['departamentos']:
+        return ', '.join(consulta['departamentos'])
+    return 'todos'
 
-# Agrupamos datos para mapa
-conteo_mpios = df.groupby(['DEPARTAMENTO_INSTALACION', 'MUNICIPIO_INSTALACION']).size().reset_index(name='TOTAL_CONVERSIONES')
-df_mapa = df.merge(conteo_mpios, on=['DEPARTAMENTO_INSTALACION', 'MUNICIPIO_INSTALACION'], how='left')
-df_mapa = df_mapa.drop_duplicates(subset=['MUNICIPIO_INSTALACION', 'DEPARTAMENTO_INSTALACION'])
+# Función con la clave de caché de la parte de la consulta que no cubre el corte simple
+def clave_consulta(consulta):
+    return json.dumps([list(consulta['departamentos']), list(consulta['municipios']),
+                       consulta['meses'], list(consulta['tipos'])], ensure_ascii=False)
 
-# Lista de años y departamentos
-anios = sorted(df['ANIO_INSTALACION'].dropna().unique().astype(int).tolist())
-departamentos = sorted(df['DEPARTAMENTO_INSTALACION'].dropna().unique().tolist())
+# Función para la serie mensual de una porción cualquiera del cubo, sobre
+# meses calendario consecutivos como en construir_series, con sus promedios
+# móviles y la variación frente al mismo mes del año anterior. Con un rango de
+# meses solo se devuelven los meses del rango y sin promedios: la ventana
+# móvil cruzaría los meses excluidos.
+def serie_consulta(cubo_filtrado, meses=None, ventanas=VENTANAS_MOVILES):
+    indice, validos = indice_mes(cubo_filtrado['ANIO_INSTALACION'], cubo_filtrado['MES_INSTALACION'])
+    if not validos.any():
+        return np.array([], dtype='datetime64[ns]'), np.array([], dtype='int64'), None, np.array([])
+    inicio = int(indice[validos].min())
+    conteos = np.bincount(indice[validos] - inicio, weights=cubo_filtrado['CONVERSIONES'].to_numpy()[validos]).astype('int64')
+    calendario = np.arange(inicio, inicio + len(conteos))
+    fechas = calendario.astype('datetime64[M]').astype('datetime64[ns]')
+    variacion = variacion_anual(conteos[np.newaxis, :])[0]
+    if meses:
+        mes = calendario % 12 + 1
+        dentro = (mes >= meses[0]) & (mes <= meses[1])
+        return fechas[dentro], conteos[dentro], None, variacion[dentro]
+    promedios = {ventana: promedio_movil(conteos[np.newaxis, :], ventana)[0] for ventana in ventanas}
+    return fechas, conteos, promedios, variacion
 
-# Preparamos datos para el análisis temporal
-df_tiempo = df.groupby(['ANIO_INSTALACION', 'MES_INSTALACION']).size().reset_index(name='CONVERSIONES')
+# ========== ESTADO DE DATOS ==========
+# Todo lo que los callbacks y el layout leen de los datos vive en un único
+# diccionario. Una recarga construye uno nuevo y lo reemplaza de una sola vez,
+# así cada request ve siempre una versión completa y consistente.
+
+# Función para preparar la serie mensual total
+def construir_tiempo(cubo):
+    df_tiempo = cubo.groupby(['ANIO_INSTALACION', 'MES_INSTALACION'])['CONVERSIONES'].sum().reset_index()
+    try:
+        df_tiempo['FECHA'] = fecha_desde_anio_mes(df_tiempo['ANIO_INSTALACION'], df_tiempo['MES_INSTALACION'])
+        df_tiempo = df_tiempo.sort_values('FECHA')
+    except Exception as e:
+        print(f"Error al crear fechas para análisis temporal: {e}")
+        # Alternativa si falla la creación de fechas
+        df_tiempo = df_tiempo.sort_values(['ANIO_INSTALACION', 'MES_INSTALACION'])
+    return df_tiempo
+
+# Función para calcular los KPIs del encabezado
+def calcular_kpis(cubo, df_tiempo):
+    conteo_total_mpios = cubo.groupby('MUNICIPIO_INSTALACION', observed=True)['CONVERSIONES'].sum()
+    if len(conteo_total_mpios) > 0:
+        municipio_top = conteo_total_mpios.idxmax()
+        cantidad_top = conteo_total_mpios.max()
+    else:
+        municipio_top = "N/A"
+        cantidad_top = 0
+    return {
+        'total_conversiones': int(cubo['CONVERSIONES'].sum()),
+        'promedio_mensual': df_tiempo['CONVERSIONES'].mean().round(0) if len(df_tiempo) else 0,
+        'municipio_top': municipio_top,
+        'cantidad_top': int(cantidad_top)
+    }
+
+# Función que construye el estado completo a partir del cubo y las coordenadas
+def construir_estado(cubo, coordenadas):
+    estado = {
+        'cubo': cubo,
+        'indice_cubo': construir_indice_cubo(cubo),
+        'coordenadas': coordenadas,
+        'cubo_mapa': None,
+        'indice_mapa': None,
+        'mapa_nacional': None,
+        'centroides': None
+    }
+    if coordenadas is not None:
+        estado['cubo_mapa'] = construir_cubo_mapa(cubo, coordenadas)
+        estado['indice_mapa'] = construir_indice_cubo(estado['cubo_mapa'])
+        estado['mapa_nacional'] = sumar_por_municipio(estado['cubo_mapa'])
+        estado['centroides'] = construir_centroides(estado['mapa_nacional'])
+
+    # Lista de años y departamentos
+    estado['anios'] = sorted(estado['indice_cubo']['anio'])
+    estado['departamentos'] = sorted(estado['indice_cubo']['departamento'])
+
+    # Preparamos datos para el análisis temporal y calculamos algunos KPIs
+    estado['df_tiempo'] = construir_tiempo(cubo)
+    estado['kpis'] = calcular_kpis(cubo, estado['df_tiempo'])
+    estado['series'] = construir_series(cubo)
+
+    # Índice de bitmaps para los filtros de detalle y sus opciones
+    estado['indice_bitmap'] = IndiceBitmap(cubo)
+    estado['municipios'] = sorted(estado['indice_bitmap'].posiciones_municipio)
+    estado['tipos'] = sorted(estado['indice_bitmap'].bitmaps.get('tipo', {}))
+
+    # La versión de los datos forma parte de la clave de la caché de figuras
+    estado['version'] = hashlib.sha1(pd.util.hash_pandas_object(cubo, index=False).to_numpy().tobytes()).hexdigest()[:16]
+    return estado
+
+estado_datos = construir_estado(construir_cubo(df, dimensiones_cubo), construir_coordenadas(df))
+# Ya nada lee el dataframe fila a fila: se libera para que cada worker no
+# conserve FECHA_INSTALACION, TRIMESTRE y las demás columnas privadas
+del df
+
+# ========== RECARGA EN CALIENTE ==========
+# Un hilo revisa cada GNCV_INTERVALO_RECARGA segundos si Database.csv creció o
+# si llegaron archivos nuevos a GNCV_DIR_INCREMENTOS. Solo se leen las filas
+# nuevas; su cubo se suma al actual y el estado se reemplaza sin reiniciar.
+# Si el CSV fue reescrito (no solo ampliado) se recarga completo.
+INTERVALO_RECARGA = int(os.environ.get('GNCV_INTERVALO_RECARGA', 60))
+DIRECTORIO_INCREMENTOS = os.environ.get('GNCV_DIR_INCREMENTOS', 'incrementos')
+
+class RecargadorDatos:
+    TAMANO_COLA = 4096
+
+    def __init__(self, ruta_csv, origen, directorio_incrementos):
+        self.ruta_csv = ruta_csv
+        self.directorio_incrementos = directorio_incrementos
+        self.procesados = set()
+        self._lock = threading.Lock()
+        # Función opcional que recibe el estado nuevo después de cada recarga
+        self.al_recargar = None
+        self._fijar_posicion(origen['tamano'] if origen else None)
+
+    # Guarda hasta dónde se leyó el CSV, su encabezado y los últimos bytes leídos
+    def _fijar_posicion(self, posicion):
+        self.posicion = posicion
+        self.encabezado = b''
+        self.cola = b''
+        if posicion is None or not os.path.exists(self.ruta_csv):
+            return
+        with open(self.ruta_csv, 'rb') as archivo:
+            self.encabezado = archivo.readline()
+            inicio = max(0, posicion - self.TAMANO_COLA)
+            archivo.seek(inicio)
+            self.cola = archivo.read(posicion - inicio)
+
+    # Devuelve las filas agregadas al final del CSV junto con la posición y la
+    # cola que quedarían después de leerlas, o None si fue reescrito. No modifica
+    # el recargador: la posición solo avanza cuando la recarga termina bien.
+    def _leer_anexo_csv(self):
+        if self.posicion is None or not os.path.exists(self.ruta_csv):
+            return [], self.posicion, self.cola
+        tamano = os.path.getsize(self.ruta_csv)
+        if tamano == self.posicion:
+            return [], self.posicion, self.cola
+        if tamano < self.posicion:
+            return None
+        with open(self.ruta_csv, 'rb') as archivo:
+            inicio = max(0, self.posicion - self.TAMANO_COLA)
+            archivo.seek(inicio)
+            if archivo.read(self.posicion - inicio) != self.cola:
+                return None
+            anexo = archivo.read(tamano - self.posicion)
+        # Solo se consumen líneas completas; lo demás se lee en la próxima revisión
+        fin = anexo.rfind(b'\n') + 1
+        if fin == 0:
+            return [], self.posicion, self.cola
+        posicion = self.posicion + fin
+        cola = (self.cola + anexo[:fin])[-self.TAMANO_COLA:]
+        if not anexo[:fin].strip():
+            return [], posicion, cola
+        return [leer_csv_crudo(io.BytesIO(self.encabezado + anexo[:fin]))], posicion, cola
+
+    # Devuelve los archivos del directorio de incrementos que no están en
+    # procesados, junto con sus nombres
+    def _leer_incrementos(self, procesados):
+        if not os.path.isdir(self.directorio_incrementos):
+            return [], set()
+        nuevos = []
+        nombres = set()
+        for nombre in sorted(os.listdir(self.directorio_incrementos)):
+            if not nombre.endswith('.csv') or nombre in procesados:
+                continue
+            nuevos.append(leer_csv_crudo(os.path.join(self.directorio_incrementos, nombre)))
+            nombres.add(nombre)
+        return nuevos, nombres
+
+    # Revisa si hay datos nuevos y, si los hay, reemplaza el estado. Devuelve True si hubo cambios.
+    # Si algo falla a mitad de camino no se marca nada como leído, así que la
+    # próxima revisión vuelve a intentar con las mismas filas y archivos.
+    def revisar(self):
+        global estado_datos
+        with self._lock:
+            base = estado_datos
+            cubos = [base['cubo']]
+            coordenadas = base['coordenadas']
+            procesados = self.procesados
+            tamano_recargado = None
+
+            lectura = self._leer_anexo_csv()
+            if lectura is None:
+                print(f"{self.ruta_csv} fue reescrito; recargando todos los datos...")
+                df_completo, origen = cargar_datos(self.ruta_csv)
+                df_completo = preprocesar_datos(df_completo, fechas=False)
+                tamano_recargado = origen['tamano']
+                procesados = set()
+                cubos = [construir_cubo(df_completo, dimensiones_cubo)]
+                coordenadas = construir_coordenadas(df_completo)
+                anexos, posicion, cola = [], None, None
+            else:
+                anexos, posicion, cola = lectura
+
+            incrementos, nombres = self._leer_incrementos(procesados)
+            partes = anexos + incrementos
+            if not partes and tamano_recargado is None:
+                # Pudo haber avanzado sobre líneas vacías
+                self.posicion, self.cola = posicion, cola
+                return False
+
+            if partes:
+                nuevos = preprocesar_datos(pd.concat(partes, ignore_index=True), fechas=False)
+                for col in dimensiones_cubo:
+                    if col not in nuevos.columns:
+                        # Categórica vacía con las categorías del cubo (no flotante), para
+                        # que la concatenación en combinar_cubos no cambie de tipo
+                        nuevos[col] = pd.Categorical([np.nan] * len(nuevos), categories=cubos[0][col].cat.categories)
+                cubos.append(construir_cubo(nuevos, dimensiones_cubo))
+                coordenadas = combinar_coordenadas(coordenadas, construir_coordenadas(nuevos))
+                print(f"Recarga de datos: {len(nuevos):,} filas nuevas")
+
+            nuevo_estado = construir_estado(combinar_cubos(cubos, dimensiones_cubo), coordenadas)
+            # Reemplazo atómico: los requests en curso terminan con el estado anterior
+            estado_datos = nuevo_estado
+
+            # Recién ahora se confirma lo leído
+            if tamano_recargado is not None:
+                self._fijar_posicion(tamano_recargado)
+            else:
+                self.posicion, self.cola = posicion, cola
+            self.procesados = procesados | nombres
+            return True
+
+    def _bucle(self, intervalo):
+        while True:
+            time.sleep(intervalo)
+            try:
+                if self.revisar():
+                    cache_figuras.podar(estado_datos['version'])
+                    if self.al_recargar:
+                        self.al_recargar(estado_datos)
+            except Exception as e:
+                print(f"Error al recargar datos: {e}")
+
+    def iniciar(self, intervalo):
+        hilo = threading.Thread(target=self._bucle, args=(intervalo,), name='gncv-recarga', daemon=True)
+        hilo.start()
+        return hilo
+
+recargador_datos = RecargadorDatos(RUTA_CSV, origen_datos, DIRECTORIO_INCREMENTOS)
+# Los incrementos que ya existan al arrancar se incorporan antes de servir.
+# Un archivo con errores no debe impedir el arranque: se reintenta en cada revisión.
 try:
-    df_tiempo['FECHA'] = pd.to_datetime(df_tiempo['ANIO_INSTALACION'].astype(str) + '-' + 
-                                    df_tiempo['MES_INSTALACION'].astype(str) + '-01',
-                                    errors='coerce')
-    df_tiempo = df_tiempo.sort_values('FECHA')
+    recargador_datos.revisar()
 except Exception as e:
-    print(f"Error al crear fechas para análisis temporal: {e}")
-    # Alternativa si falla la creación de fechas
-    df_tiempo = df_tiempo.sort_values(['ANIO_INSTALACION', 'MES_INSTALACION'])
-
-# Calculamos algunos KPIs
-total_conversiones = len(df)
-promedio_mensual = df.groupby(['ANIO_INSTALACION', 'MES_INSTALACION']).size().mean().round(0)
-if len(df['MUNICIPIO_INSTALACION'].value_counts()) > 0:
-    municipio_top = df['MUNICIPIO_INSTALACION'].value_counts().idxmax()
-    cantidad_top = df['MUNICIPIO_INSTALACION'].value_counts().max()
-else:
-    municipio_top = "N/A"
-    cantidad_top = 0
+    print(f"Error al incorporar incrementos al arrancar: {e}")
+if INTERVALO_RECARGA > 0:
+    recargador_datos.iniciar(INTERVALO_RECARGA)
 
 # Colores temáticos para la aplicación
 colores = {
@@ -137,6 +943,102 @@ estilo_titulo_principal = {
     'margin': '0 0 20px 0'
 }
 
+# ========== MODO CLIENTE ==========
+# Con GNCV_MODO_CLIENTE=1 los agregados (ya pequeños) se envían una sola vez
+# en un dcc.Store y el filtrado y los gráficos se resuelven en el navegador
+# (assets/gncv_cliente.js), sin ida y vuelta al servidor por cada filtro.
+MODO_CLIENTE = os.environ.get('GNCV_MODO_CLIENTE', '0') == '1'
+
+# Función para pasar una columna categórica a códigos enteros en lista
+def codigos_lista(serie):
+    return serie.cat.codes.astype('int32').tolist()
+
+# Función para pasar una matriz de reales a listas redondeadas (NaN viaja como null)
+def matriz_lista(matriz, decimales):
+    return [[round(float(v), decimales) if np.isfinite(v) else None for v in fila] for fila in matriz]
+
+# Función que arma el payload compacto para el modo cliente
+def construir_payload_cliente(estado):
+    cubo = estado['cubo']
+    cubo_mapa = estado['cubo_mapa']
+    mensual = (
+        cubo.groupby(['ANIO_INSTALACION', 'MES_INSTALACION', 'DEPARTAMENTO_INSTALACION'], observed=True)['CONVERSIONES']
+        .sum()
+        .reset_index()
+    )
+    payload = {
+        'departamentos': cubo['DEPARTAMENTO_INSTALACION'].cat.categories.astype(str).tolist(),
+        'municipios': cubo['MUNICIPIO_INSTALACION'].cat.categories.astype(str).tolist(),
+        'mensual': {
+            'anio': mensual['ANIO_INSTALACION'].astype('int32').tolist(),
+            'mes': mensual['MES_INSTALACION'].astype('int32').tolist(),
+            'dep': codigos_lista(mensual['DEPARTAMENTO_INSTALACION']),
+            'total': mensual['CONVERSIONES'].tolist()
+        },
+        'series': None,
+        'mapa': None,
+        'centroides': None,
+        'zoom_detalle': ZOOM_DETALLE,
+        'tipos': None,
+        'colores': colores,
+        'secuencia_colores': px.colors.qualitative.Plotly,
+        'plantilla': pio.templates['plotly_white'].to_plotly_json()
+    }
+    series = estado['series']
+    if series is not None:
+        # Las mismas series densas que usa el servidor
+        payload['series'] = {
+            'inicio': series['inicio'],
+            'conteos': series['conteos'].tolist(),
+            'promedios': {str(ventana): matriz_lista(promedio, 3) for ventana, promedio in series['promedios'].items()},
+            'variacion': matriz_lista(series['variacion_anual'], 4)
+        }
+    if cubo_mapa is not None:
+        payload['mapa'] = {
+            'anio': cubo_mapa['ANIO_INSTALACION'].astype('int32').tolist(),
+            'dep': codigos_lista(cubo_mapa['DEPARTAMENTO_INSTALACION']),
+            'mun': codigos_lista(cubo_mapa['MUNICIPIO_INSTALACION']),
+            'total': cubo_mapa['TOTAL_CONVERSIONES'].tolist(),
+            'lat': cubo_mapa['LATITUD_MUNICIPIO'].round(5).tolist(),
+            'lon': cubo_mapa['LONGITUD_MUNICIPIO'].round(5).tolist()
+        }
+        # Centroides por código de departamento para el nivel de detalle del mapa (null si no tiene)
+        payload['centroides'] = {
+            'lat': [round(float(v), 5) if np.isfinite(v) else None for v in estado['centroides']['LATITUD_MUNICIPIO']],
+            'lon': [round(float(v), 5) if np.isfinite(v) else None for v in estado['centroides']['LONGITUD_MUNICIPIO']]
+        }
+    else:
+        # Sin coordenadas el top de municipios sale de este resumen
+        por_mpio = cubo.groupby(['ANIO_INSTALACION'] + columnas_mpio, observed=True)['CONVERSIONES'].sum().reset_index()
+        payload['municipal'] = {
+            'anio': por_mpio['ANIO_INSTALACION'].astype('int32').tolist(),
+            'dep': codigos_lista(por_mpio['DEPARTAMENTO_INSTALACION']),
+            'mun': codigos_lista(por_mpio['MUNICIPIO_INSTALACION']),
+            'total': por_mpio['CONVERSIONES'].tolist()
+        }
+    if 'TIPO_VEHICULO' in cubo.columns:
+        por_tipo = (
+            cubo.groupby(['ANIO_INSTALACION', 'DEPARTAMENTO_INSTALACION', 'TIPO_VEHICULO'], observed=True)['CONVERSIONES']
+            .sum()
+            .reset_index()
+        )
+        payload['tipos'] = {
+            'nombres': cubo['TIPO_VEHICULO'].cat.categories.astype(str).tolist(),
+            'anio': por_tipo['ANIO_INSTALACION'].astype('int32').tolist(),
+            'dep': codigos_lista(por_tipo['DEPARTAMENTO_INSTALACION']),
+            'tipo': codigos_lista(por_tipo['TIPO_VEHICULO']),
+            'total': por_tipo['CONVERSIONES'].tolist()
+        }
+    return payload
+
+# Función que entrega el payload del estado actual (se arma una vez por versión)
+def payload_cliente(estado):
+    if not MODO_CLIENTE:
+        return None
+    if 'payload_cliente' not in estado:
+        estado['payload_cliente'] = construir_payload_cliente(estado)
+    return estado['payload_cliente']
+
 # ========== INICIAR APP ==========
 app = dash.Dash(
     __name__, 
@@ -147,155 +1049,1033 @@ app = dash.Dash(
 app.title = 'Dashboard GNCV Colombia'
 
 # ========== LAYOUT ==========
-app.layout = html.Div([
-    # Encabezado
-    html.Div([
-        html.H1('Dashboard de Conversiones a GNCV en Colombia', style=estilo_titulo_principal),
-        html.P("Análisis de datos de conversiones a Gas Natural Comprimido Vehicular", 
-               style={'textAlign': 'center', 'marginBottom': '30px'}),
-    ]),
+# Función para las opciones del filtro de año
+def opciones_anio(estado):
+    return [{'label': str(anio), 'value': anio} for anio in estado['anios']] + [{'label': 'Todos', 'value': 'todos'}]
+
+# Función para las opciones del filtro de departamento
+# (en modo servidor es de selección múltiple y "todos" es no elegir ninguno)
+def opciones_departamento(estado):
+    opciones = [{'label': dep, 'value': dep} for dep in estado['departamentos']]
+    if MODO_CLIENTE:
+        opciones.append({'label': 'Todos', 'value': 'todos'})
+    return opciones
+
+# Función para las opciones de municipios, limitadas a los departamentos elegidos
+def opciones_municipio(estado, departamentos=None):
+    elegidos = set(normalizar_consulta('todos', departamentos)['departamentos'])
+    opciones = []
+    for clave in estado['municipios']:
+        departamento, municipio = clave.split(SEPARADOR_MUNICIPIO, 1)
+        if not elegidos or departamento in elegidos:
+            opciones.append({'label': f'{municipio} ({departamento})', 'value': clave})
+    return opciones
+
+# Función para las opciones de tipo de vehículo
+def opciones_tipo(estado):
+    return [{'label': tipo, 'value': tipo} for tipo in estado['tipos']]
+
+nombres_meses = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
+
+# Función con los controles de los filtros de detalle (solo en modo servidor)
+def filtros_detalle(estado):
+    if MODO_CLIENTE:
+        return []
+    return [
+        html.Label('Filtrar por Municipio', style={'marginTop': '15px'}),
+        dcc.Dropdown(
+            options=opciones_municipio(estado),
+            value=[],
+            multi=True,
+            placeholder='Todos',
+            id='filtro-municipios'
+        ),
+
+        html.Label('Rango de meses', style={'marginTop': '15px'}),
+        dcc.RangeSlider(
+            min=1,
+            max=12,
+            step=1,
+            value=[1, 12],
+            marks={mes: nombre for mes, nombre in enumerate(nombres_meses, start=1)},
+            id='filtro-meses'
+        ),
+
+        # Sin columna TIPO_VEHICULO el control existe (es entrada del callback) pero no se muestra
+        html.Div([
+            html.Label('Filtrar por Tipo de Vehículo', style={'marginTop': '15px'}),
+            dcc.Dropdown(
+                options=opciones_tipo(estado),
+                value=[],
+                multi=True,
+                placeholder='Todos',
+                id='filtro-tipos'
+            )
+        ], style={} if estado['tipos'] else {'display': 'none'})
+    ]
+
+# Función con los textos de las tarjetas de KPIs
+def texto_kpis(estado):
+    kpis = estado['kpis']
+    return {
+        'kpi-total': f"{kpis['total_conversiones']:,}",
+        'kpi-promedio': f"{int(kpis['promedio_mensual']):,}",
+        'kpi-top': f"{kpis['municipio_top']}",
+        'kpi-top-detalle': f"Municipio Top ({kpis['cantidad_top']:,} conversiones)"
+    }
+
+# El layout se arma en cada carga de página a partir del estado vigente,
+# así una recarga de datos se refleja también en las páginas nuevas
+def construir_layout():
+    estado = estado_datos
+    kpis = texto_kpis(estado)
+    # En modo servidor la página sale con las figuras completas de la vista
+    # inicial; los callbacks luego solo envían parches (ver parche_figura)
+    figuras = figuras_iniciales(estado)
+    return html.Div([
+        # Agregados para el modo cliente (vacío en modo servidor)
+        dcc.Store(id='datos-cliente', data=payload_cliente(estado)),
+
+        # Versión de los datos que muestra esta página y revisión periódica de recargas
+        dcc.Store(id='version-datos', data=estado['version']),
+        # Nivel de detalle que muestra el mapa (departamentos o municipios)
+        dcc.Store(id='nivel-mapa', data=nivel_mapa('todos')),
+        dcc.Interval(id='intervalo-datos', interval=max(INTERVALO_RECARGA, 1) * 1000, disabled=INTERVALO_RECARGA <= 0),
+        # Se activa solo si un render no terminó a tiempo, para pedirlo de nuevo a la caché
+        dcc.Interval(id='reintento-render', interval=REINTENTO_RENDER_MS, disabled=True),
+
+        # Encabezado
+        html.Div([
+            html.H1('Dashboard de Conversiones a GNCV en Colombia', style=estilo_titulo_principal),
+            html.P("Análisis de datos de conversiones a Gas Natural Comprimido Vehicular", 
+                   style={'textAlign': 'center', 'marginBottom': '30px'}),
+        ]),
     
-    # Fila de KPIs
-    html.Div([
-        # KPI 1: Total conversiones
+        # Fila de KPIs
         html.Div([
-            html.Div(f"{total_conversiones:,}", style=estilo_indicador),
-            html.Div("Total Conversiones", style=estilo_subtitulo)
-        ], style=estilo_tarjeta, className='four columns'),
+            # KPI 1: Total conversiones
+            html.Div([
+                html.Div(kpis['kpi-total'], id='kpi-total', style=estilo_indicador),
+                html.Div("Total Conversiones", style=estilo_subtitulo)
+            ], style=estilo_tarjeta, className='four columns'),
         
-        # KPI 2: Promedio mensual
-        html.Div([
-            html.Div(f"{int(promedio_mensual):,}", style=estilo_indicador),
-            html.Div("Promedio Mensual", style=estilo_subtitulo)
-        ], style=estilo_tarjeta, className='four columns'),
+            # KPI 2: Promedio mensual
+            html.Div([
+                html.Div(kpis['kpi-promedio'], id='kpi-promedio', style=estilo_indicador),
+                html.Div("Promedio Mensual", style=estilo_subtitulo)
+            ], style=estilo_tarjeta, className='four columns'),
         
-        # KPI 3: Municipio top
-        html.Div([
-            html.Div(f"{municipio_top}", style=estilo_indicador),
-            html.Div(f"Municipio Top ({cantidad_top:,} conversiones)", style=estilo_subtitulo)
-        ], style=estilo_tarjeta, className='four columns'),
-    ], className='row', style={'margin': '0 15px 30px 15px'}),
+            # KPI 3: Municipio top
+            html.Div([
+                html.Div(kpis['kpi-top'], id='kpi-top', style=estilo_indicador),
+                html.Div(kpis['kpi-top-detalle'], id='kpi-top-detalle', style=estilo_subtitulo)
+            ], style=estilo_tarjeta, className='four columns'),
+        ], className='row', style={'margin': '0 15px 30px 15px'}),
     
-    # Fila de filtros y gráficos principales
-    html.Div([
-        # Panel de filtros
+        # Fila de filtros y gráficos principales
         html.Div([
+            # Panel de filtros
             html.Div([
-                html.H3("Filtros", style={'color': colores['primario'], 'marginBottom': '20px'}),
+                html.Div([
+                    html.H3("Filtros", style={'color': colores['primario'], 'marginBottom': '20px'}),
                 
-                html.Label('Filtrar por Año'),
-                dcc.Dropdown(
-                    options=[{'label': str(anio), 'value': anio} for anio in anios] + [{'label': 'Todos', 'value': 'todos'}],
-                    value='todos',
-                    id='filtro-anio',
-                    clearable=False
-                ),
+                    html.Label('Filtrar por Año'),
+                    dcc.Dropdown(
+                        options=opciones_anio(estado),
+                        value='todos',
+                        id='filtro-anio',
+                        clearable=False
+                    ),
                 
-                html.Label('Filtrar por Departamento', style={'marginTop': '15px'}),
-                dcc.Dropdown(
-                    options=[{'label': dep, 'value': dep} for dep in departamentos] + [{'label': 'Todos', 'value': 'todos'}],
-                    value='todos',
-                    id='filtro-departamento',
-                    clearable=False
-                ),
+                    html.Label('Filtrar por Departamento', style={'marginTop': '15px'}),
+                    dcc.Dropdown(
+                        options=opciones_departamento(estado),
+                        value='todos' if MODO_CLIENTE else [],
+                        multi=not MODO_CLIENTE,
+                        placeholder='Todos',
+                        id='filtro-departamento',
+                        clearable=not MODO_CLIENTE
+                    ),
+
+                    *filtros_detalle(estado),
                 
-                html.Div([
-                    html.Button('Restablecer Filtros', id='btn-reset', 
-                              style={
-                                  'marginTop': '20px',
-                                  'backgroundColor': colores['secundario'],
-                                  'color': 'white',
-                                  'border': 'none',
-                                  'padding': '10px 15px',
-                                  'borderRadius': '5px',
-                                  'cursor': 'pointer',
-                                  'width': '100%'
-                              })
-                ], style={'textAlign': 'center', 'marginTop': '10px'})
-            ], style=estilo_tarjeta)
-        ], className='three columns'),
+                    html.Div([
+                        html.Button('Restablecer Filtros', id='btn-reset', 
+                                  style={
+                                      'marginTop': '20px',
+                                      'backgroundColor': colores['secundario'],
+                                      'color': 'white',
+                                      'border': 'none',
+                                      'padding': '10px 15px',
+                                      'borderRadius': '5px',
+                                      'cursor': 'pointer',
+                                      'width': '100%'
+                                  })
+                    ], style={'textAlign': 'center', 'marginTop': '10px'})
+                ], style=estilo_tarjeta)
+            ], className='three columns'),
         
-        # Gráficos principales
-        html.Div([
-            # Gráfico de tendencia temporal
+            # Gráficos principales
             html.Div([
-                dcc.Graph(
-                    id='grafico-tendencia',
-                    figure=px.line(
-                        df_tiempo, 
-                        x='FECHA' if 'FECHA' in df_tiempo.columns else 'ANIO_INSTALACION', 
-                        y='CONVERSIONES',
-                        title='Tendencia de Conversiones a lo Largo del Tiempo',
-                        labels={'CONVERSIONES': 'Cantidad de Conversiones', 'FECHA': 'Fecha', 'ANIO_INSTALACION': 'Año'},
-                        template='plotly_white'
-                    ).update_layout(
-                        title_font_size=16,
-                        xaxis=dict(tickangle=-45),
-                        margin=dict(l=40, r=40, t=60, b=40)
-                    )
-                )
-            ], style=estilo_tarjeta),
+                # Gráfico de tendencia temporal
+                html.Div([
+                    dcc.Graph(id='grafico-tendencia', figure=figuras['grafico-tendencia'])
+                ], style=estilo_tarjeta),
             
-            # Fila de gráficos secundarios
-            html.Div([
-                # Gráfico de barras
+                # Fila de gráficos secundarios
                 html.Div([
-                    dcc.Graph(id='grafico-barras')
-                ], className='six columns', style=estilo_tarjeta),
+                    # Gráfico de barras
+                    html.Div([
+                        dcc.Graph(id='grafico-barras', figure=figuras['grafico-barras'])
+                    ], className='six columns', style=estilo_tarjeta),
                 
-                # Gráfico de tipo de vehículo (asumiendo que existe esa columna)
-                html.Div([
-                    dcc.Graph(id='grafico-tipo-vehiculo')
-                ], className='six columns', style=estilo_tarjeta)
-            ], className='row'),
+                    # Gráfico de tipo de vehículo (asumiendo que existe esa columna)
+                    html.Div([
+                        dcc.Graph(id='grafico-tipo-vehiculo', figure=figuras['grafico-tipo-vehiculo'])
+                    ], className='six columns', style=estilo_tarjeta)
+                ], className='row'),
             
-            # Mapa
-            html.Div([
-                dcc.Graph(id='mapa-conversiones')
-            ], style=estilo_tarjeta)
-        ], className='nine columns'),
-    ], className='row', style={'margin': '0 15px'}),
+                # Mapa
+                html.Div([
+                    dcc.Graph(id='mapa-conversiones', figure=figuras['mapa-conversiones'])
+                ], style=estilo_tarjeta)
+            ], className='nine columns'),
+        ], className='row', style={'margin': '0 15px'}),
     
-    # Footer con información adicional
-    html.Div([
-        html.P('Dashboard desarrollado para análisis de conversiones GNCV en Colombia', 
-               style={'textAlign': 'center', 'color': colores['texto'], 'padding': '20px 0 10px 0'})
-    ], style={'marginTop': '30px', 'borderTop': f'1px solid {colores["secundario"]}'}),
+        # Footer con información adicional
+        html.Div([
+            html.P('Dashboard desarrollado para análisis de conversiones GNCV en Colombia', 
+                   style={'textAlign': 'center', 'color': colores['texto'], 'padding': '20px 0 10px 0'})
+        ], style={'marginTop': '30px', 'borderTop': f'1px solid {colores["secundario"]}'}),
     
-], style={'backgroundColor': colores['fondo'], 'fontFamily': 'Arial, sans-serif'})
+    ], style={'backgroundColor': colores['fondo'], 'fontFamily': 'Arial, sans-serif'})
+
+
+# ========== MÉTRICAS ==========
+# Histogramas de latencia por etapa de los callbacks (filtro, agregación,
+# construcción de figuras, serialización) y del tamaño de cada figura, en
+# formato de texto de Prometheus en /metrics. Cada worker de gunicorn expone
+# sus propias series, distinguidas por la etiqueta pid.
+LIMITES_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+LIMITES_BYTES = (1_000, 5_000, 10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 5_000_000)
+
+class Histograma:
+    def __init__(self, nombre, ayuda, limites):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.limites = limites
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(sorted(etiquetas.items()))
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = {'cubetas': [0] * len(self.limites), 'suma': 0.0, 'cuenta': 0}
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie['cubetas'][i] += 1
+            serie['suma'] += valor
+            serie['cuenta'] += 1
+
+    def exponer(self, etiquetas_base):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        with self._lock:
+            series = [(clave, dict(serie, cubetas=list(serie['cubetas']))) for clave, serie in self._series.items()]
+        for clave, serie in series:
+            etiquetas = etiquetas_base + list(clave)
+            for limite, cuenta in zip(self.limites, serie['cubetas']):
+                lineas.append(f'{self.nombre}_bucket{{{formatear_etiquetas(etiquetas + [("le", repr(float(limite)))])}}} {cuenta}')
+            lineas.append(f'{self.nombre}_bucket{{{formatear_etiquetas(etiquetas + [("le", "+Inf")])}}} {serie["cuenta"]}')
+            lineas.append(f'{self.nombre}_sum{{{formatear_etiquetas(etiquetas)}}} {serie["suma"]}')
+            lineas.append(f'{self.nombre}_count{{{formatear_etiquetas(etiquetas)}}} {serie["cuenta"]}')
+        return lineas
+
+# Función para escribir etiquetas en el formato de Prometheus
+def formatear_etiquetas(etiquetas):
+    return ','.join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in etiquetas)
+
+histograma_etapas = Histograma(
+    'gncv_callback_etapa_segundos', 'Duración de cada etapa de los callbacks del dashboard', LIMITES_LATENCIA
+)
+histograma_callbacks = Histograma(
+    'gncv_callback_segundos', 'Duración total del callback del dashboard', LIMITES_LATENCIA
+)
+histograma_payload = Histograma(
+    'gncv_figura_bytes', 'Tamaño en bytes del JSON de cada figura', LIMITES_BYTES
+)
+
+# Cronómetro por llamada: acumula el tiempo de cada etapa y lo registra al final
+class Cronometro:
+    def __init__(self, callback):
+        self.callback = callback
+        self.etapas = {}
+        self._ultimo = time.perf_counter()
+
+    # Asigna a la etapa el tiempo transcurrido desde la marca anterior
+    def parcial(self, etapa):
+        ahora = time.perf_counter()
+        self.etapas[etapa] = self.etapas.get(etapa, 0.0) + (ahora - self._ultimo)
+        self._ultimo = ahora
+
+    def registrar(self):
+        for etapa, segundos in self.etapas.items():
+            histograma_etapas.observar(segundos, callback=self.callback, etapa=etapa)
+
+@app.server.route('/metrics')
+def metricas():
+    etiquetas_base = [('pid', os.getpid())]
+    lineas = []
+    for histograma in (histograma_callbacks, histograma_etapas, histograma_payload):
+        lineas.extend(histograma.exponer(etiquetas_base))
+    lineas.extend(precalentador.exponer(etiquetas_base))
+    return '\n'.join(lineas) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# ========== COMPRESIÓN Y ETAGS ==========
+# Todas las respuestas de app.server (callbacks, layout, bundles de JS y
+# assets) salen comprimidas con brotli o gzip según lo que acepte el cliente.
+# Los cuerpos comprimidos se guardan en una LRU por contenido, así una vista
+# repetida o un asset ya servido no se vuelven a comprimir. Los GET llevan
+# ETag y responden 304 si el cliente ya tiene esa versión.
+# GNCV_COMPRESION=0 desactiva la capa (p. ej. detrás de un proxy que comprime).
+COMPRESION_ACTIVA = os.environ.get('GNCV_COMPRESION', '1') != '0'
+COMPRESION_MINIMA = 500
+tipos_comprimibles = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+class CacheComprimidos:
+    def __init__(self, max_entradas=256):
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, cuerpo, codificacion):
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                return self._entradas[clave]
+        comprimido = comprimir(cuerpo, codificacion)
+        with self._lock:
+            self._entradas[clave] = comprimido
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return comprimido
+
+cache_comprimidos = CacheComprimidos(int(os.environ.get('GNCV_CACHE_COMPRIMIDOS', 256)))
+
+# Función para comprimir un cuerpo con la codificación elegida
+def comprimir(cuerpo, codificacion):
+    if codificacion == 'br':
+        return brotli.compress(cuerpo, quality=5)
+    return gzip.compress(cuerpo, compresslevel=6, mtime=0)
+
+# Función para elegir la codificación según Accept-Encoding (brotli primero)
+def elegir_codificacion(aceptadas):
+    if brotli is not None and aceptadas['br'] > 0:
+        return 'br'
+    if aceptadas['gzip'] > 0:
+        return 'gzip'
+    return None
+
+# Función que comprime de antemano los assets propios (JS y CSS de assets/)
+# para que el primer visitante ya reciba la versión comprimida desde la caché
+def precomprimir_assets():
+    directorio = app.config.assets_folder
+    if not os.path.isdir(directorio):
+        return
+    cliente = app.server.test_client()
+    codificaciones = ['gzip'] + (['br'] if brotli is not None else [])
+    for nombre in sorted(os.listdir(directorio)):
+        if nombre.endswith(('.js', '.css')):
+            for codificacion in codificaciones:
+                cliente.get(app.get_asset_url(nombre), headers={'Accept-Encoding': codificacion})
+
+@app.server.after_request
+def comprimir_respuesta(respuesta):
+    if (not COMPRESION_ACTIVA or respuesta.status_code != 200 or 'Content-Encoding' in respuesta.headers
+            or not respuesta.mimetype.startswith(tipos_comprimibles)):
+        return respuesta
+    peticion = flask.request
+    respuesta.direct_passthrough = False
+    cuerpo = respuesta.get_data()
+
+    # La clave del contenido es su ETag (assets) o el hash del cuerpo (callbacks, bundles con huella)
+    etag = respuesta.get_etag()[0] or hashlib.sha1(cuerpo).hexdigest()[:20]
+    codificacion = elegir_codificacion(peticion.accept_encodings) if len(cuerpo) >= COMPRESION_MINIMA else None
+    etag_variante = f'{etag}-{codificacion}' if codificacion else etag
+    respuesta.vary.add('Accept-Encoding')
+
+    if peticion.method == 'GET':
+        respuesta.set_etag(etag_variante)
+        if etag_variante in peticion.if_none_match or etag in peticion.if_none_match:
+            no_modificado = flask.Response(status=304)
+            no_modificado.set_etag(etag_variante)
+            no_modificado.vary.add('Accept-Encoding')
+            if respuesta.cache_control.max_age is not None:
+                no_modificado.cache_control.max_age = respuesta.cache_control.max_age
+            return no_modificado
+
+    if codificacion:
+        respuesta.set_data(cache_comprimidos.obtener((etag, codificacion), cuerpo, codificacion))
+        respuesta.headers['Content-Encoding'] = codificacion
+    return respuesta
+
+# ========== CACHÉ DE FIGURAS ==========
+# El espacio de filtros es pequeño (años x departamentos), así que las figuras
+# de cada combinación se guardan ya serializadas. La caché en memoria es LRU y
+# opcionalmente se respalda en disco (GNCV_CACHE_DIR) para que los workers de
+# gunicorn compartan lo que ya renderizó cualquiera de ellos. En disco cada
+# versión de los datos tiene su subdirectorio, que se borra (con sus archivos
+# de bloqueo) cuando esa versión deja de ser la vigente.
+# Cambiar VERSION_FORMATO_CACHE si cambia la forma de las figuras guardadas.
+VERSION_FORMATO_CACHE = 2
+
+# Las consultas con filtros de detalle son casi siempre únicas: van a una LRU
+# aparte y pequeña (GNCV_CACHE_DETALLE_MAX), solo en memoria, para que no
+# llenen el disco ni desplacen las combinaciones de año y departamento.
+class CacheFiguras:
+    def __init__(self, max_entradas=512, directorio=None, max_detalle=64):
+        self.max_entradas = max_entradas
+        self.max_detalle = max_detalle
+        self.directorio = directorio
+        self._entradas = OrderedDict()
+        self._detalle = OrderedDict()
+        self._lock = threading.Lock()
+        if self.directorio:
+            os.makedirs(self.directorio, exist_ok=True)
+
+    # 'detalle' es la clave de los filtros de detalle (ver clave_consulta), si los hay
+    def _clave(self, version, anio, departamento, detalle=None):
+        return json.dumps([VERSION_FORMATO_CACHE, version, anio, departamento] + ([detalle] if detalle else []),
+                          ensure_ascii=False)
+
+    def _directorio_version(self, version):
+        return os.path.join(self.directorio, f'figuras-v{VERSION_FORMATO_CACHE}-{version}')
+
+    def _ruta(self, version, clave):
+        nombre = hashlib.sha1(clave.encode('utf-8')).hexdigest()
+        return os.path.join(self._directorio_version(version), f'{nombre}.json')
+
+    def obtener(self, version, anio, departamento, detalle=None):
+        clave = self._clave(version, anio, departamento, detalle)
+        entradas = self._detalle if detalle else self._entradas
+        with self._lock:
+            if clave in entradas:
+                entradas.move_to_end(clave)
+                return entradas[clave]
+        if not self.directorio or detalle:
+            return None
+        try:
+            with open(self._ruta(version, clave), encoding='utf-8') as archivo:
+                contenido = archivo.read()
+        except OSError:
+            return None
+        self._guardar_memoria(clave, contenido)
+        return contenido
+
+    def guardar(self, version, anio, departamento, contenido, detalle=None):
+        clave = self._clave(version, anio, departamento, detalle)
+        if detalle:
+            self._guardar_memoria(clave, contenido, self._detalle, self.max_detalle)
+            return
+        self._guardar_memoria(clave, contenido)
+        if not self.directorio:
+            return
+        # Escritura atómica para que otro worker nunca lea un archivo a medias
+        try:
+            directorio = self._directorio_version(version)
+            os.makedirs(directorio, exist_ok=True)
+            fd, ruta_tmp = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as archivo:
+                archivo.write(contenido)
+            os.replace(ruta_tmp, self._ruta(version, clave))
+        except OSError as e:
+            print(f"No se pudo escribir la caché de figuras en disco: {e}")
+
+    # Bloqueo entre procesos por combinación de filtros, para que solo un worker
+    # de gunicorn la renderice y los demás la lean del disco (las consultas de
+    # detalle no se comparten entre workers, así que no lo necesitan)
+    @contextmanager
+    def bloqueo(self, version, anio, departamento, detalle=None):
+        if not self.directorio or fcntl is None or detalle:
+            yield
+            return
+        try:
+            os.makedirs(self._directorio_version(version), exist_ok=True)
+            archivo = open(self._ruta(version, self._clave(version, anio, departamento, detalle)) + '.lock', 'w')
+        except OSError as e:
+            # Sin bloqueo el peor caso es que dos workers rendericen lo mismo
+            print(f"No se pudo crear el bloqueo de la caché de figuras: {e}")
+            yield
+            return
+        with archivo:
+            fcntl.flock(archivo, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(archivo, fcntl.LOCK_UN)
+
+    # Descarta las figuras de versiones de datos anteriores, en memoria y en disco.
+    # Los archivos sueltos en la raíz son del formato anterior a los subdirectorios.
+    def podar(self, version):
+        with self._lock:
+            for entradas in (self._entradas, self._detalle):
+                for clave in [clave for clave in entradas if json.loads(clave)[:2] != [VERSION_FORMATO_CACHE, version]]:
+                    del entradas[clave]
+        if not self.directorio:
+            return
+        vigente = os.path.basename(self._directorio_version(version))
+        try:
+            nombres = os.listdir(self.directorio)
+        except OSError as e:
+            print(f"No se pudo revisar la caché de figuras en disco: {e}")
+            return
+        for nombre in nombres:
+            ruta = os.path.join(self.directorio, nombre)
+            if nombre.startswith('figuras-v') and nombre != vigente:
+                shutil.rmtree(ruta, ignore_errors=True)
+            elif nombre.endswith(('.json', '.json.lock', '.tmp')) and os.path.isfile(ruta):
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+
+    def _guardar_memoria(self, clave, contenido, entradas=None, maximo=None):
+        if entradas is None:
+            entradas, maximo = self._entradas, self.max_entradas
+        with self._lock:
+            entradas[clave] = contenido
+            entradas.move_to_end(clave)
+            while len(entradas) > maximo:
+                entradas.popitem(last=False)
+
+# La versión de los datos forma parte de la clave para no servir figuras viejas
+cache_figuras = CacheFiguras(
+    max_entradas=int(os.environ.get('GNCV_CACHE_MAX', 512)),
+    directorio=os.environ.get('GNCV_CACHE_DIR') or None,
+    max_detalle=int(os.environ.get('GNCV_CACHE_DETALLE_MAX', 64))
+)
+# Al arrancar se borra lo que dejaron versiones anteriores de los datos
+cache_figuras.podar(estado_datos['version'])
+
+# ========== COLA DE RENDERIZADO ==========
+# Los renders que no están en caché pasan por una cola local con un número fijo
+# de hilos (GNCV_HILOS_RENDER). Si llegan varios requests por la misma
+# combinación mientras se renderiza, todos esperan el mismo resultado en vez de
+# recalcularlo. Con gunicorn en modo gthread (ver render.yaml) los hilos que
+# esperan no bloquean al worker. Nadie espera más de GNCV_TIMEOUT_RENDER
+# segundos (0 = sin límite); el render sigue y al terminar queda en caché, de
+# donde la página lo recoge con el intervalo 'reintento-render'.
+REINTENTO_RENDER_MS = 2000
+
+class ColaRenderizado:
+    def __init__(self, hilos=2, tiempo_maximo=None):
+        self.tiempo_maximo = tiempo_maximo
+        self._pool = ThreadPoolExecutor(max_workers=max(1, hilos), thread_name_prefix='gncv-render')
+        self._en_curso = {}
+        self._lock = threading.Lock()
+
+    # Ejecuta funcion(*args) una sola vez por clave en curso. Devuelve (resultado, compartido).
+    # Con limite=True lanza TiempoAgotado si el resultado no llega a tiempo.
+    def ejecutar(self, clave, funcion, *args, limite=True):
+        with self._lock:
+            futuro = self._en_curso.get(clave)
+            compartido = futuro is not None
+            if not compartido:
+                futuro = self._pool.submit(funcion, *args)
+                self._en_curso[clave] = futuro
+        if not compartido:
+            futuro.add_done_callback(lambda terminado: self._liberar(clave, terminado))
+        return futuro.result(timeout=self.tiempo_maximo if limite else None), compartido
+
+    def _liberar(self, clave, futuro):
+        with self._lock:
+            if self._en_curso.get(clave) is futuro:
+                del self._en_curso[clave]
+
+cola_renderizado = ColaRenderizado(
+    hilos=int(os.environ.get('GNCV_HILOS_RENDER', 2)),
+    tiempo_maximo=float(os.environ.get('GNCV_TIMEOUT_RENDER', 10)) or None
+)
 
 # ========== CALLBACKS ==========
 
+# Función que resuelve el estado efectivo de los filtros (incluido el botón de reset)
+def resolver_filtros(anio, departamento):
+    if reinicio_solicitado():
+        anio = 'todos'
+        departamento = 'todos'
+    return anio, departamento
+
+# Función que indica si el callback lo disparó el botón de reset
+def reinicio_solicitado():
+    ctx = callback_context
+    return bool(ctx.triggered) and ctx.triggered[0]['prop_id'].split('.')[0] == 'btn-reset'
+
+salidas_dashboard = [
+    Output('grafico-barras', 'figure'),
+    Output('mapa-conversiones', 'figure'),
+    Output('grafico-tipo-vehiculo', 'figure'),
+    Output('grafico-tendencia', 'figure')
+]
+entradas_dashboard = [
+    Input('filtro-anio', 'value'),
+    Input('filtro-departamento', 'value'),
+    Input('btn-reset', 'n_clicks'),
+    Input('version-datos', 'data')
+]
+# Filtros de detalle (solo en modo servidor)
+entradas_detalle = [
+    Input('filtro-municipios', 'value'),
+    Input('filtro-meses', 'value'),
+    Input('filtro-tipos', 'value')
+]
+
+# Función que devuelve las cuatro figuras serializadas, desde la caché o renderizándolas
+# Con 'consulta' (filtros de detalle) las figuras se arman desde el índice de bitmaps
+# limite=False espera el render sin importar GNCV_TIMEOUT_RENDER
+def obtener_figuras(estado, anio, departamento, consulta=None, limite=True):
+    detalle = clave_consulta(consulta) if consulta else None
+    # Las vistas repetidas salen de la caché sin pasar por pandas ni plotly
+    figuras_json = cache_figuras.obtener(estado['version'], anio, departamento, detalle)
+    if figuras_json is not None:
+        return figuras_json, 'hit'
+    clave = (estado['version'], anio, departamento, detalle)
+    try:
+        figuras_json, compartido = cola_renderizado.ejecutar(clave, renderizar_y_guardar, estado, anio, departamento, consulta,
+                                                             limite=limite)
+    except TiempoAgotado:
+        # No se guarda en caché: el render en curso la llenará cuando termine
+        print(f"Render de {anio}/{departamento}{' ' + detalle if detalle else ''} sin terminar tras {cola_renderizado.tiempo_maximo} s")
+        fig_error = figura_mensaje("El gráfico está tardando más de lo normal; se mostrará apenas esté listo")
+        return pio.json.to_json_plotly([fig_error] * len(salidas_dashboard)), 'timeout'
+    return figuras_json, 'coalescido' if compartido else 'miss'
+
+# Función que corre en la cola: renderiza y guarda, salvo que otro worker ya lo haya hecho
+def renderizar_y_guardar(estado, anio, departamento, consulta=None):
+    detalle = clave_consulta(consulta) if consulta else None
+    with cache_figuras.bloqueo(estado['version'], anio, departamento, detalle):
+        figuras_json = cache_figuras.obtener(estado['version'], anio, departamento, detalle)
+        if figuras_json is None:
+            figuras_json = renderizar_figuras(estado, anio, departamento, consulta)
+            cache_figuras.guardar(estado['version'], anio, departamento, figuras_json, detalle)
+    return figuras_json
+
+# Función que arma las figuras completas de la vista inicial para el layout
+def figuras_iniciales(estado):
+    ids = [salida.component_id for salida in salidas_dashboard]
+    if MODO_CLIENTE:
+        # El callback del navegador las dibuja al cargar la página
+        return {id_grafico: {} for id_grafico in ids}
+    # La vista inicial no se actualiza sola: se espera el render aunque tarde
+    figuras_json, _ = obtener_figuras(estado, 'todos', 'todos', limite=False)
+    return dict(zip(ids, json.loads(figuras_json)))
+
+# Función que reduce una figura completa al parche de lo que cambia con los
+# filtros: trazos, título, anotaciones y encuadre del mapa. Plantilla, ejes,
+# márgenes y leyenda quedan los del render inicial del layout.
+def parche_figura(figura):
+    layout = figura.get('layout', {})
+    parche = Patch()
+    parche['data'] = figura.get('data', [])
+    parche['layout']['title'] = layout.get('title', {'text': ''})
+    parche['layout']['annotations'] = layout.get('annotations', [])
+    if 'mapbox' in layout:
+        parche['layout']['mapbox']['zoom'] = layout['mapbox']['zoom']
+        parche['layout']['mapbox']['center'] = layout['mapbox']['center']
+        parche['layout']['uirevision'] = layout.get('uirevision')
+    return parche
+
+# Callback único: filtra una sola vez y reparte el resultado a los cuatro gráficos
+def actualizar_dashboard(anio, departamento, n_clicks, version, municipios=None, meses=None, tipos=None,
+                         reintentos=None):
+    inicio = time.perf_counter()
+    anio, departamento = resolver_filtros(anio, departamento)
+    if reinicio_solicitado():
+        municipios = meses = tipos = None
+    # Un solo acceso al estado: todo el request usa la misma versión de los datos
+    estado = estado_datos
+
+    # Año y un solo departamento usan los cortes precalculados; el resto, el índice de bitmaps
+    consulta = normalizar_consulta(anio, departamento, municipios, meses, tipos)
+    departamento = departamento_consulta(consulta)
+    detalle = None if es_consulta_simple(consulta) else consulta
+    figuras_json, cache = obtener_figuras(estado, consulta['anio'], departamento, detalle)
+    respuesta = [parche_figura(figura) for figura in json.loads(figuras_json)]
+    histograma_callbacks.observar(time.perf_counter() - inicio, callback='actualizar_dashboard', cache=cache)
+    # Si el render no llegó a tiempo, el intervalo vuelve a llamar este callback hasta que esté en caché
+    return respuesta + [nivel_consulta(consulta), cache != 'timeout']
+
+# Función que construye las cuatro figuras y las devuelve serializadas en JSON
+def renderizar_figuras(estado, anio, departamento, consulta=None):
+    crono = Cronometro('actualizar_dashboard')
+
+    # Porción del cubo que corresponde a los filtros, compartida por todos los gráficos
+    if consulta is None:
+        cubo_filtrado = filtrar_cubo(estado['cubo'], estado['indice_cubo'], anio, departamento)
+    else:
+        cubo_filtrado = estado['cubo'].iloc[estado['indice_bitmap'].filtrar(consulta)]
+    crono.parcial('filtro')
+
+    if consulta is None:
+        fig_barras, fig_mapa, fig_tipo = actualizar_graficos(estado, cubo_filtrado, anio, departamento)
+        fig_tendencia = actualizar_tendencia(estado, anio, departamento)
+    else:
+        puntos = None
+        if estado['cubo_mapa'] is not None:
+            puntos = puntos_desde_tabla(estado, tabla_mapa_consulta(estado, cubo_filtrado), nivel_consulta(consulta))
+        fig_barras, fig_mapa, fig_tipo = actualizar_graficos(estado, cubo_filtrado, anio, departamento, puntos,
+                                                             f'{anio}|{clave_consulta(consulta)}')
+        fig_tendencia = actualizar_tendencia(estado, anio, departamento, cubo_filtrado, consulta['meses'])
+    crono.parcial('graficos')
+
+    figuras = zip(salidas_dashboard, [fig_barras, fig_mapa, fig_tipo, fig_tendencia])
+    partes = []
+    for salida, fig in figuras:
+        parte = pio.json.to_json_plotly(fig)
+        histograma_payload.observar(len(parte.encode('utf-8')), grafico=salida.component_id)
+        partes.append(parte)
+    crono.parcial('serializacion')
+    crono.registrar()
+    return '[' + ','.join(partes) + ']'
+
+# En modo cliente el mismo callback corre en el navegador sobre el payload del Store
+if MODO_CLIENTE:
+    app.clientside_callback(
+        ClientsideFunction(namespace='gncv', function_name='actualizar_dashboard'),
+        salidas_dashboard + [Output('nivel-mapa', 'data')],
+        entradas_dashboard + [State('datos-cliente', 'data')]
+    )
+    # Nivel de detalle del mapa según el zoom, también en el navegador
+    app.clientside_callback(
+        ClientsideFunction(namespace='gncv', function_name='detallar_mapa'),
+        [Output('mapa-conversiones', 'figure', allow_duplicate=True),
+         Output('nivel-mapa', 'data', allow_duplicate=True)],
+        [Input('mapa-conversiones', 'relayoutData')],
+        [State('nivel-mapa', 'data'),
+         State('filtro-anio', 'value'),
+         State('filtro-departamento', 'value'),
+         State('datos-cliente', 'data')],
+        prevent_initial_call=True
+    )
+else:
+    # La vista inicial ya viene completa en el layout: solo se responde a cambios
+    app.callback(
+        salidas_dashboard + [Output('nivel-mapa', 'data'), Output('reintento-render', 'disabled')],
+        entradas_dashboard + entradas_detalle + [Input('reintento-render', 'n_intervals')],
+        prevent_initial_call=True
+    )(actualizar_dashboard)
+
+    # Callback que cambia el nivel de detalle del mapa cuando el usuario hace zoom.
+    # Solo envía el trazo nuevo al cruzar GNCV_ZOOM_DETALLE, no en cada paneo.
+    @app.callback(
+        [Output('mapa-conversiones', 'figure', allow_duplicate=True),
+         Output('nivel-mapa', 'data', allow_duplicate=True)],
+        [Input('mapa-conversiones', 'relayoutData')],
+        [State('nivel-mapa', 'data'),
+         State('filtro-anio', 'value'),
+         State('filtro-departamento', 'value'),
+         State('filtro-municipios', 'value'),
+         State('filtro-meses', 'value'),
+         State('filtro-tipos', 'value')],
+        prevent_initial_call=True
+    )
+    def detallar_mapa(relayout, nivel_actual, anio, departamento, municipios, meses, tipos):
+        if not relayout or 'mapbox.zoom' not in relayout:
+            raise PreventUpdate
+        consulta = normalizar_consulta(anio, departamento, municipios, meses, tipos)
+        nivel = nivel_consulta(consulta, relayout['mapbox.zoom'])
+        estado = estado_datos
+        if nivel == nivel_actual or estado['cubo_mapa'] is None:
+            raise PreventUpdate
+        inicio = time.perf_counter()
+        if es_consulta_simple(consulta):
+            puntos = puntos_mapa(estado, anio, departamento_consulta(consulta), nivel)
+        else:
+            cubo_filtrado = estado['cubo'].iloc[estado['indice_bitmap'].filtrar(consulta)]
+            puntos = puntos_desde_tabla(estado, tabla_mapa_consulta(estado, cubo_filtrado), nivel)
+        parche = Patch()
+        parche['data'] = [trazo_mapa(puntos)]
+        histograma_callbacks.observar(time.perf_counter() - inicio, callback='detallar_mapa', cache='miss')
+        return parche, nivel
+
+# Callback que refresca filtros, KPIs (y el payload del modo cliente) cuando
+# cambia la versión de los datos; los gráficos se actualizan porque dependen
+# de 'version-datos'
+salidas_refresco = [
+    Output('filtro-anio', 'options'),
+    Output('filtro-departamento', 'options'),
+    Output('kpi-total', 'children'),
+    Output('kpi-promedio', 'children'),
+    Output('kpi-top', 'children'),
+    Output('kpi-top-detalle', 'children'),
+    Output('version-datos', 'data')
+]
+if MODO_CLIENTE:
+    salidas_refresco.append(Output('datos-cliente', 'data'))
+
 @app.callback(
-    [Output('grafico-barras', 'figure'),
-     Output('mapa-conversiones', 'figure'),
-     Output('grafico-tipo-vehiculo', 'figure')],
-    [Input('filtro-anio', 'value'),
-     Input('filtro-departamento', 'value'),
-     Input('btn-reset', 'n_clicks')]
+    salidas_refresco,
+    [Input('intervalo-datos', 'n_intervals')],
+    [State('version-datos', 'data')]
 )
-def actualizar_graficos(anio, departamento, n_clicks):
-    try:
-        # Verificar si se ha presionado el botón de reset
-        ctx = callback_context
-        if ctx.triggered:
-            id_trigger = ctx.triggered[0]['prop_id'].split('.')[0]
-            if id_trigger == 'btn-reset':
-                anio = 'todos'
-                departamento = 'todos'
-        
-        # Filtro base
-        df_filtrado = df.copy()
-        df_mapa_filtrado = df_mapa.copy()
+def refrescar_datos(n_intervals, version_pagina):
+    estado = estado_datos
+    if version_pagina == estado['version']:
+        raise PreventUpdate
+    kpis = texto_kpis(estado)
+    salida = [
+        opciones_anio(estado),
+        opciones_departamento(estado),
+        kpis['kpi-total'],
+        kpis['kpi-promedio'],
+        kpis['kpi-top'],
+        kpis['kpi-top-detalle'],
+        estado['version']
+    ]
+    if MODO_CLIENTE:
+        salida.append(payload_cliente(estado))
+    return salida
+
+# Callback que limita los municipios a los departamentos elegidos y refresca
+# las opciones de detalle cuando cambian los datos
+if not MODO_CLIENTE:
+    @app.callback(
+        [Output('filtro-municipios', 'options'),
+         Output('filtro-tipos', 'options')],
+        [Input('filtro-departamento', 'value'),
+         Input('version-datos', 'data')],
+        prevent_initial_call=True
+    )
+    def actualizar_opciones_detalle(departamentos, version):
+        estado = estado_datos
+        return opciones_municipio(estado, departamentos), opciones_tipo(estado)
+
+# ========== PRECALENTAMIENTO ==========
+# Con GNCV_PRECALENTAR=1, al arrancar (y después de cada recarga de datos) un
+# pool de hilos renderiza en segundo plano todas las combinaciones de año y
+# departamento y las deja en la caché de figuras, así ningún usuario paga el
+# primer render. El servidor atiende requests desde el inicio.
+# GNCV_PRECALENTAR_CPU es el presupuesto en núcleos (0.5 = medio núcleo):
+# cada hilo descansa en proporción a lo que trabajó para no superarlo.
+PRECALENTAR = os.environ.get('GNCV_PRECALENTAR', '0') == '1'
+
+class Precalentador:
+    def __init__(self, hilos=2, presupuesto_cpu=0.5):
+        self.hilos = max(1, hilos)
+        self.presupuesto_cpu = presupuesto_cpu
+        self.version = None
+        self.total = 0
+        self.completadas = 0
+        self._lock = threading.Lock()
+
+    # Todas las combinaciones de filtros que puede pedir la página
+    def combinaciones(self, estado):
+        return [(anio, departamento)
+                for anio in ['todos'] + estado['anios']
+                for departamento in ['todos'] + estado['departamentos']]
+
+    def _renderizar(self, estado, anio, departamento):
+        # Si los datos se recargaron, esta ronda ya no sirve: la siguiente la reemplaza
+        if estado_datos['version'] != estado['version']:
+            return
+        inicio = time.perf_counter()
+        try:
+            obtener_figuras(estado, anio, departamento)
+        except Exception as e:
+            print(f"Error al precalentar {anio}/{departamento}: {e}")
+        trabajo = time.perf_counter() - inicio
+        # Con n hilos trabajando una fracción t/(t+d) del tiempo el uso total es el presupuesto
+        if self.presupuesto_cpu > 0:
+            time.sleep(max(0.0, trabajo * (self.hilos / self.presupuesto_cpu - 1)))
+        with self._lock:
+            if self.version != estado['version']:
+                return
+            self.completadas += 1
+            completadas, total = self.completadas, self.total
+        paso = max(1, total // 10)
+        if completadas % paso == 0 or completadas == total:
+            print(f"Precalentamiento: {completadas}/{total} combinaciones ({completadas / total:.0%})")
+
+    def _ejecutar(self, estado):
+        inicio = time.perf_counter()
+        combinaciones = self.combinaciones(estado)
+        with self._lock:
+            self.version = estado['version']
+            self.total = len(combinaciones)
+            self.completadas = 0
+        if len(combinaciones) > cache_figuras.max_entradas and not cache_figuras.directorio:
+            print(f"Aviso: {len(combinaciones)} combinaciones no caben en la caché de figuras "
+                  f"({cache_figuras.max_entradas}); aumente GNCV_CACHE_MAX o use GNCV_CACHE_DIR")
+        with ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix='gncv-precalentamiento') as pool:
+            for anio, departamento in combinaciones:
+                pool.submit(self._renderizar, estado, anio, departamento)
+        if estado_datos['version'] == estado['version']:
+            print(f"Precalentamiento completo en {time.perf_counter() - inicio:.1f} s")
+
+    def iniciar(self, estado):
+        hilo = threading.Thread(target=self._ejecutar, args=(estado,), name='gncv-precalentamiento', daemon=True)
+        hilo.start()
+        return hilo
+
+    # Progreso en formato de Prometheus para /metrics
+    def exponer(self, etiquetas_base):
+        with self._lock:
+            completadas, total = self.completadas, self.total
+        etiquetas = formatear_etiquetas(etiquetas_base)
+        return [
+            '# HELP gncv_precalentamiento_combinaciones Combinaciones de filtros a precalentar en la versión actual',
+            '# TYPE gncv_precalentamiento_combinaciones gauge',
+            f'gncv_precalentamiento_combinaciones{{{etiquetas}}} {total}',
+            '# HELP gncv_precalentamiento_completadas Combinaciones ya renderizadas en la caché',
+            '# TYPE gncv_precalentamiento_completadas gauge',
+            f'gncv_precalentamiento_completadas{{{etiquetas}}} {completadas}'
+        ]
+
+precalentador = Precalentador(
+    hilos=int(os.environ.get('GNCV_PRECALENTAR_HILOS', 2)),
+    presupuesto_cpu=float(os.environ.get('GNCV_PRECALENTAR_CPU', 0.5))
+)
+
+# ========== CONSTRUCCIÓN DE FIGURAS ==========
+# Las figuras de los callbacks se arman como diccionarios de plotly a partir
+# de arreglos NumPy ya agregados, sin pasar por plotly.express ni por la
+# validación de go.Figure. La plantilla se resuelve una sola vez.
+plantilla_figuras = pio.templates['plotly_white'].to_plotly_json()
+secuencia_colores = px.colors.qualitative.Plotly
+CENTRO_COLOMBIA = {'lat': 4.5709, 'lon': -74.2973}
+
+# Función para el layout base compartido por todas las figuras
+def layout_base(titulo, tamano_titulo, margen, **extra):
+    layout = {
+        'template': plantilla_figuras,
+        'title': {'text': titulo, 'font': {'size': tamano_titulo}},
+        'margin': margen,
+        'legend': {'tracegroupgap': 0}
+    }
+    layout.update(extra)
+    return layout
+
+# Función para un gráfico de barras verticales de una sola serie
+def figura_barras(x, y, titulo, etiqueta_x, etiqueta_y, color, margen, tamano_titulo=14, eje_x=None):
+    return {
+        'data': [{
+            'type': 'bar',
+            'x': x,
+            'y': y,
+            'marker': {'color': color},
+            'orientation': 'v',
+            'showlegend': False,
+            'hovertemplate': f'{etiqueta_x}=%{{x}}<br>{etiqueta_y}=%{{y}}<extra></extra>'
+        }],
+        'layout': layout_base(
+            titulo, tamano_titulo, margen,
+            xaxis=dict({'title': {'text': etiqueta_x}}, **(eje_x or {})),
+            yaxis={'title': {'text': etiqueta_y}},
+            barmode='relative'
+        )
+    }
+
+# Función para el trazo único del mapa de burbujas: el color de cada punto
+# sale del código de su departamento, así es estable entre niveles y filtros
+def trazo_mapa(puntos):
+    totales = puntos['total']
+    sizeref = 2.0 * float(totales.max()) / (20 ** 2) if len(totales) else 1.0
+    paleta = np.array(secuencia_colores, dtype=object)
+    return {
+        'type': 'scattermapbox',
+        'mode': 'markers',
+        'showlegend': False,
+        'lat': puntos['lat'],
+        'lon': puntos['lon'],
+        'hovertext': puntos['nombre'],
+        'customdata': np.column_stack([puntos['departamento'], totales]),
+        'hovertemplate': '<b>%{hovertext}</b><br><br>DEPARTAMENTO_INSTALACION=%{customdata[0]}<br>'
+                         'TOTAL_CONVERSIONES=%{customdata[1]}<extra></extra>',
+        'marker': {
+            'color': paleta[puntos['codigo'] % len(paleta)],
+            'size': totales,
+            'sizemode': 'area',
+            'sizeref': sizeref
+        },
+        'subplot': 'mapbox'
+    }
+
+# Función para el mapa de burbujas
+# 'revision' identifica los filtros: mientras no cambie, Plotly conserva el zoom
+# del usuario aunque detallar_mapa reemplace los puntos
+def figura_mapa(puntos, zoom, titulo, centro=CENTRO_COLOMBIA, revision=None):
+    return {
+        'data': [trazo_mapa(puntos)],
+        'layout': layout_base(
+            titulo, 14, {'l': 0, 'r': 0, 't': 50, 'b': 0},
+            mapbox={'style': 'carto-positron', 'zoom': zoom, 'center': centro},
+            uirevision=revision
+        )
+    }
+
+# Función para un gráfico de torta (dona)
+def figura_torta(etiquetas, valores, titulo, margen):
+    return {
+        'data': [{
+            'type': 'pie',
+            'labels': etiquetas,
+            'values': valores,
+            'hole': 0.4,
+            'hovertemplate': 'label=%{label}<br>value=%{value}<extra></extra>'
+        }],
+        'layout': layout_base(titulo, 14, margen)
+    }
 
-        if anio and anio != 'todos':
-            df_filtrado = df_filtrado[df_filtrado['ANIO_INSTALACION'] == anio]
-            df_mapa_filtrado = df_mapa_filtrado[df_mapa_filtrado['ANIO_INSTALACION'] == anio]
+# Función para la línea de tendencia con sus promedios móviles (dict ventana -> valores)
+def figura_tendencia(fechas, valores, titulo, promedios=None, variacion=None):
+    trazo = {
+        'type': 'scatter',
+        'mode': 'lines',
+        'x': fechas,
+        'y': valores,
+        'line': {'dash': 'solid'},
+        'showlegend': False,
+        'hovertemplate': 'Fecha=%{x}<br>Cantidad de Conversiones=%{y}<extra></extra>'
+    }
+    if variacion is not None:
+        trazo['customdata'] = variacion
+        trazo['hovertemplate'] = ('Fecha=%{x}<br>Cantidad de Conversiones=%{y}<br>'
+                                  'Variación anual=%{customdata:+.1%}<extra></extra>')
+    trazos = [trazo]
+    for i, (ventana, promedio) in enumerate(sorted((promedios or {}).items())):
+        trazos.append({
+            'type': 'scatter',
+            'mode': 'lines',
+            'x': fechas,
+            'y': promedio,
+            'name': f'Promedio móvil ({ventana} meses)',
+            'line': {'color': colores['resalte'] if i == 0 else secuencia_colores[(i + 1) % len(secuencia_colores)],
+                     'width': 2, 'dash': 'dash' if i == 0 else 'dot'}
+        })
+    return {
+        'data': trazos,
+        'layout': layout_base(
+            titulo, 16, {'l': 40, 'r': 40, 't': 60, 'b': 40},
+            xaxis={'title': {'text': 'Fecha'}, 'tickangle': -45},
+            yaxis={'title': {'text': 'Cantidad de Conversiones'}},
+            legend={'tracegroupgap': 0, 'orientation': 'h', 'yanchor': 'bottom', 'y': 1.02, 'xanchor': 'right', 'x': 1}
+        )
+    }
 
-        if departamento and departamento != 'todos':
-            df_filtrado = df_filtrado[df_filtrado['DEPARTAMENTO_INSTALACION'] == departamento]
-            df_mapa_filtrado = df_mapa_filtrado[df_mapa_filtrado['DEPARTAMENTO_INSTALACION'] == departamento]
+# Función para un gráfico vacío con un mensaje
+def figura_mensaje(texto, titulo=None):
+    layout = {
+        'annotations': [{'text': texto, 'xref': 'paper', 'yref': 'paper', 'x': 0.5, 'y': 0.5, 'showarrow': False}]
+    }
+    if titulo:
+        layout['title'] = {'text': titulo, 'font': {'size': 14}}
+    return {'data': [], 'layout': layout}
 
+# Función para construir barras, mapa y gráfico por tipo a partir del cubo filtrado
+def actualizar_graficos(estado, cubo_filtrado, anio, departamento, puntos=None, revision=None):
+    crono = Cronometro('actualizar_graficos')
+    try:
         # Título dinámico basado en filtros
         titulo_filtro = 'Top 10 municipios por conversiones'
         if anio != 'todos' and departamento != 'todos':
@@ -306,21 +2086,16 @@ def actualizar_graficos(anio, departamento, n_clicks):
             titulo_filtro += f' en {departamento}'
 
         # Gráfico de barras
-        conteo_municipios = df_filtrado['MUNICIPIO_INSTALACION'].value_counts().nlargest(10)
-        fig_barras = px.bar(
-            conteo_municipios,
-            x=conteo_municipios.index,
-            y=conteo_municipios.values,
-            labels={'x': 'Municipio', 'y': 'Cantidad de conversiones'},
-            title=titulo_filtro,
-            color_discrete_sequence=[colores['primario']],
-            template='plotly_white'
-        )
-        fig_barras.update_layout(
-            xaxis={'categoryorder': 'total descending', 'tickangle': -45},
-            margin=dict(l=40, r=20, t=50, b=80),
-            title_font_size=14
+        conteo_municipios = top_municipios(cubo_filtrado, 10)
+        crono.parcial('agregacion')
+        fig_barras = figura_barras(
+            conteo_municipios.index.to_numpy(dtype=object),
+            conteo_municipios.to_numpy(),
+            titulo_filtro, 'Municipio', 'Cantidad de conversiones', colores['primario'],
+            {'l': 40, 'r': 20, 't': 50, 'b': 80},
+            eje_x={'categoryorder': 'total descending', 'tickangle': -45}
         )
+        crono.parcial('figura')
 
         # Mapa
         zoom_level = 4
@@ -328,127 +2103,72 @@ def actualizar_graficos(anio, departamento, n_clicks):
             zoom_level = 6
         
         # Verificar que existan las columnas necesarias para el mapa
-        if all(col in df_mapa_filtrado.columns for col in ['LATITUD_MUNICIPIO', 'LONGITUD_MUNICIPIO']):
-            fig_mapa = px.scatter_mapbox(
-                df_mapa_filtrado,
-                lat='LATITUD_MUNICIPIO',
-                lon='LONGITUD_MUNICIPIO',
-                color='DEPARTAMENTO_INSTALACION',
-                size='TOTAL_CONVERSIONES',
-                hover_name='MUNICIPIO_INSTALACION',
-                hover_data={
-                    'DEPARTAMENTO_INSTALACION': True,
-                    'TOTAL_CONVERSIONES': True,
-                    'LATITUD_MUNICIPIO': False,
-                    'LONGITUD_MUNICIPIO': False
-                },
-                mapbox_style='carto-positron',
-                zoom=zoom_level,
-                title='Distribución geográfica de conversiones GNCV',
-                color_discrete_sequence=px.colors.qualitative.Plotly
-            )
-            fig_mapa.update_layout(
-                margin=dict(l=0, r=0, t=50, b=0),
-                title_font_size=14,
-                mapbox=dict(center=dict(lat=4.5709, lon=-74.2973))  # Centrado en Colombia
-            )
+        if estado['cubo_mapa'] is not None:
+            if puntos is None:
+                puntos = puntos_mapa(estado, anio, departamento, nivel_mapa(departamento))
+            crono.parcial('agregacion')
+            # Con un departamento elegido el mapa se centra en sus municipios
+            centro = CENTRO_COLOMBIA
+            if departamento != 'todos' and len(puntos['lat']):
+                centro = {'lat': float(np.mean(puntos['lat'])), 'lon': float(np.mean(puntos['lon']))}
+            fig_mapa = figura_mapa(puntos, zoom_level, 'Distribución geográfica de conversiones GNCV', centro,
+                                   revision or f'{anio}|{departamento}')
         else:
             # Crear un mapa vacío si faltan columnas
-            fig_mapa = go.Figure()
-            fig_mapa.add_annotation(
-                text="No hay datos geográficos disponibles",
-                xref="paper", yref="paper",
-                x=0.5, y=0.5, showarrow=False
-            )
-            fig_mapa.update_layout(
-                title="Distribución geográfica - Datos no disponibles",
-                title_font_size=14
-            )
+            fig_mapa = figura_mensaje("No hay datos geográficos disponibles", "Distribución geográfica - Datos no disponibles")
+        crono.parcial('figura')
 
         # Gráfico por tipo de vehículo (asumiendo que existe la columna TIPO_VEHICULO)
         # Si no existe, crear un gráfico alternativo con otra información relevante
-        if 'TIPO_VEHICULO' in df_filtrado.columns:
-            conteo_tipo = df_filtrado['TIPO_VEHICULO'].value_counts()
-            fig_tipo = px.pie(
-                values=conteo_tipo.values,
-                names=conteo_tipo.index,
-                title='Distribución por Tipo de Vehículo',
-                hole=0.4,
-                template='plotly_white'
+        if 'TIPO_VEHICULO' in cubo_filtrado.columns:
+            conteo_tipo = cubo_filtrado.groupby('TIPO_VEHICULO', observed=True)['CONVERSIONES'].sum().sort_values(ascending=False)
+            crono.parcial('agregacion')
+            fig_tipo = figura_torta(
+                conteo_tipo.index.to_numpy(dtype=object), conteo_tipo.to_numpy(),
+                'Distribución por Tipo de Vehículo', {'l': 20, 'r': 20, 't': 50, 'b': 20}
             )
         else:
             # Alternativa: Gráfico por año o mes
-            conteo_tiempo = df_filtrado.groupby('ANIO_INSTALACION').size().reset_index(name='CONVERSIONES')
-            fig_tipo = px.bar(
-                conteo_tiempo,
-                x='ANIO_INSTALACION',
-                y='CONVERSIONES',
-                title='Conversiones por Año',
-                labels={'ANIO_INSTALACION': 'Año', 'CONVERSIONES': 'Cantidad de conversiones'},
-                color_discrete_sequence=[colores['secundario']],
-                template='plotly_white'
+            conteo_tiempo = cubo_filtrado.groupby('ANIO_INSTALACION')['CONVERSIONES'].sum()
+            crono.parcial('agregacion')
+            fig_tipo = figura_barras(
+                conteo_tiempo.index.to_numpy(), conteo_tiempo.to_numpy(),
+                'Conversiones por Año', 'Año', 'Cantidad de conversiones', colores['secundario'],
+                {'l': 20, 'r': 20, 't': 50, 'b': 20}
             )
-        
-        fig_tipo.update_layout(
-            margin=dict(l=20, r=20, t=50, b=20),
-            title_font_size=14
-        )
+        crono.parcial('figura')
+        crono.registrar()
 
         return fig_barras, fig_mapa, fig_tipo
     
     except Exception as e:
         # En caso de error, devolver gráficos vacíos con mensaje
-        fig_error = go.Figure()
-        fig_error.add_annotation(
-            text=f"Error al generar el gráfico: {str(e)}",
-            xref="paper", yref="paper",
-            x=0.5, y=0.5, showarrow=False
-        )
-        
+        fig_error = figura_mensaje(f"Error al generar el gráfico: {str(e)}")
         return fig_error, fig_error, fig_error
 
-# Callback para actualizar el gráfico de tendencia cuando se aplican filtros
-@app.callback(
-    Output('grafico-tendencia', 'figure'),
-    [Input('filtro-anio', 'value'),
-     Input('filtro-departamento', 'value'),
-     Input('btn-reset', 'n_clicks')]
-)
-def actualizar_tendencia(anio, departamento, n_clicks):
+# Función para construir el gráfico de tendencia a partir de las series precalculadas
+def actualizar_tendencia(estado, anio, departamento, cubo_filtrado=None, rango_meses=None):
+    crono = Cronometro('actualizar_tendencia')
     try:
-        # Verificar si se ha presionado el botón de reset
-        ctx = callback_context
-        if ctx.triggered:
-            id_trigger = ctx.triggered[0]['prop_id'].split('.')[0]
-            if id_trigger == 'btn-reset':
-                anio = 'todos'
-                departamento = 'todos'
-        
-        # Filtro base
-        df_filtrado = df.copy()
-
-        if anio and anio != 'todos':
-            df_filtrado = df_filtrado[df_filtrado['ANIO_INSTALACION'] == anio]
-
-        if departamento and departamento != 'todos':
-            df_filtrado = df_filtrado[df_filtrado['DEPARTAMENTO_INSTALACION'] == departamento]
-
-        # Preparamos datos para el análisis temporal
-        df_tiempo_filtrado = df_filtrado.groupby(['ANIO_INSTALACION', 'MES_INSTALACION']).size().reset_index(name='CONVERSIONES')
-        
-        # Intentamos crear la columna de fecha, con manejo de errores
-        tiene_fecha = False
-        try:
-            df_tiempo_filtrado['FECHA'] = pd.to_datetime(
-                df_tiempo_filtrado['ANIO_INSTALACION'].astype(str) + '-' + 
-                df_tiempo_filtrado['MES_INSTALACION'].astype(str) + '-01',
-                errors='coerce'
-            )
-            df_tiempo_filtrado = df_tiempo_filtrado.sort_values('FECHA')
-            tiene_fecha = True
-        except Exception:
-            # Si falla, ordenamos por año y mes
-            df_tiempo_filtrado = df_tiempo_filtrado.sort_values(['ANIO_INSTALACION', 'MES_INSTALACION'])
+        series = estado['series']
+        fila, meses = cortar_serie(series, anio, departamento)
+        if cubo_filtrado is not None:
+            # Filtros de detalle: serie de esa porción del cubo
+            fechas, valores, promedios, variacion = serie_consulta(cubo_filtrado, rango_meses)
+            if len(valores) <= 3:
+                promedios = None
+        elif fila is None:
+            fechas = valores = np.array([])
+            promedios = variacion = None
+        else:
+            fechas = series['fechas'][meses]
+            valores = series['conteos'][fila, meses]
+            # Promedios móviles si hay suficientes datos
+            promedios = None
+            if len(valores) > 3:
+                promedios = {ventana: promedio[fila, meses] for ventana, promedio in series['promedios'].items()}
+            variacion = series['variacion_anual'][fila, meses]
+        crono.parcial('agregacion')
         
         # Título dinámico
         titulo_tendencia = 'Tendencia de Conversiones a lo Largo del Tiempo'
@@ -459,58 +2179,26 @@ def actualizar_tendencia(anio, departamento, n_clicks):
         elif departamento != 'todos':
             titulo_tendencia = f'Tendencia de Conversiones en {departamento}'
         
-        # Gráfico de tendencia usando FECHA o ANIO_INSTALACION/MES_INSTALACION
-        if tiene_fecha:
-            fig_tendencia = px.line(
-                df_tiempo_filtrado, 
-                x='FECHA', 
-                y='CONVERSIONES',
-                title=titulo_tendencia,
-                labels={'CONVERSIONES': 'Cantidad de Conversiones', 'FECHA': 'Fecha'},
-                template='plotly_white'
-            )
-            
-            # Añadir promedio móvil si hay suficientes datos
-            if len(df_tiempo_filtrado) > 3:
-                df_tiempo_filtrado['PROMEDIO_MOVIL'] = df_tiempo_filtrado['CONVERSIONES'].rolling(window=3).mean()
-                fig_tendencia.add_scatter(
-                    x=df_tiempo_filtrado['FECHA'], 
-                    y=df_tiempo_filtrado['PROMEDIO_MOVIL'],
-                    mode='lines',
-                    name='Promedio móvil (3 meses)',
-                    line=dict(color=colores['resalte'], width=2, dash='dash')
-                )
-        else:
-            # Alternativa sin columna de fecha
-            df_tiempo_filtrado['PERIODO'] = df_tiempo_filtrado['ANIO_INSTALACION'].astype(str) + '-' + df_tiempo_filtrado['MES_INSTALACION'].astype(str)
-            fig_tendencia = px.bar(
-                df_tiempo_filtrado, 
-                x='PERIODO', 
-                y='CONVERSIONES',
-                title=titulo_tendencia,
-                labels={'CONVERSIONES': 'Cantidad de Conversiones', 'PERIODO': 'Año-Mes'},
-                template='plotly_white',
-                color_discrete_sequence=[colores['primario']]
-            )
-        
-        fig_tendencia.update_layout(
-            title_font_size=16,
-            xaxis=dict(tickangle=-45),
-            legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
-            margin=dict(l=40, r=40, t=60, b=40)
-        )
+        fig_tendencia = figura_tendencia(fechas, valores, titulo_tendencia, promedios, variacion)
+        crono.parcial('figura')
+        crono.registrar()
         
         return fig_tendencia
     
     except Exception as e:
         # En caso de error, devolver gráfico vacío con mensaje
-        fig_error = go.Figure()
-        fig_error.add_annotation(
-            text=f"Error al generar el gráfico de tendencia: {str(e)}",
-            xref="paper", yref="paper",
-            x=0.5, y=0.5, showarrow=False
-        )
-        return fig_error
+        return figura_mensaje(f"Error al generar el gráfico de tendencia: {str(e)}")
+
+# El layout se asigna al final: Dash lo evalúa al asignarlo y la vista
+# inicial necesita los callbacks y constructores de figuras ya definidos
+app.layout = construir_layout
+if COMPRESION_ACTIVA:
+    precomprimir_assets()
+
+# El precalentamiento arranca cuando ya está todo definido y no bloquea el servidor
+if PRECALENTAR and not MODO_CLIENTE:
+    precalentador.iniciar(estado_datos)
+    recargador_datos.al_recargar = precalentador.iniciar
 
 # ========== RUN ==========
 if __name__ == '__main__':
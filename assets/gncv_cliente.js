@@ -0,0 +1,302 @@
+// Modo cliente del dashboard GNCV (GNCV_MODO_CLIENTE=1).
+// Recibe el payload de agregados del dcc.Store 'datos-cliente' y arma las
+// mismas cuatro figuras que el callback del servidor, sin ida y vuelta.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    gncv: {
+        actualizar_dashboard: function(anio, departamento, n_clicks, version, datos) {
+            if (!datos) {
+                return window.dash_clientside.no_update;
+            }
+
+            // Verificar si se ha presionado el botón de reset
+            var ctx = window.dash_clientside.callback_context;
+            if (ctx && ctx.triggered && ctx.triggered.length &&
+                    ctx.triggered[0].prop_id.split('.')[0] === 'btn-reset') {
+                anio = 'todos';
+                departamento = 'todos';
+            }
+            var filtraAnio = anio !== null && anio !== undefined && anio !== 'todos';
+            var filtraDep = departamento !== null && departamento !== undefined && departamento !== 'todos';
+            var codigoDep = filtraDep ? datos.departamentos.indexOf(departamento) : -1;
+
+            // Función para saber si una fila del payload pasa los filtros
+            function pasa(tabla, i) {
+                return (!filtraAnio || tabla.anio[i] === anio) && (!filtraDep || tabla.dep[i] === codigoDep);
+            }
+
+            var sufijo = '';
+            if (filtraAnio && filtraDep) {
+                sufijo = ' en ' + departamento + ' durante ' + anio;
+            } else if (filtraAnio) {
+                sufijo = ' durante ' + anio;
+            } else if (filtraDep) {
+                sufijo = ' en ' + departamento;
+            }
+
+            // Como en el servidor, un departamento elegido muestra sus municipios
+            var nivel = filtraDep ? 'municipios' : 'departamentos';
+            return [
+                figuraBarras(datos, pasa, sufijo),
+                figuraMapa(datos, pasa, filtraDep, nivel, anio + '|' + departamento),
+                figuraTipo(datos, pasa),
+                figuraTendencia(datos, filtraAnio ? anio : null, filtraDep, codigoDep, sufijo),
+                nivel
+            ];
+        },
+
+        // Cambia el nivel de detalle del mapa al cruzar datos.zoom_detalle con el zoom
+        detallar_mapa: function(relayout, nivelActual, anio, departamento, datos) {
+            var sinCambio = window.dash_clientside.no_update;
+            if (!datos || !datos.mapa || !relayout || relayout['mapbox.zoom'] === undefined) {
+                return [sinCambio, sinCambio];
+            }
+            var filtraAnio = anio !== null && anio !== undefined && anio !== 'todos';
+            var filtraDep = departamento !== null && departamento !== undefined && departamento !== 'todos';
+            var nivel = filtraDep || relayout['mapbox.zoom'] >= datos.zoom_detalle ? 'municipios' : 'departamentos';
+            if (nivel === nivelActual) {
+                return [sinCambio, sinCambio];
+            }
+            var codigoDep = filtraDep ? datos.departamentos.indexOf(departamento) : -1;
+            var pasa = function(tabla, i) {
+                return (!filtraAnio || tabla.anio[i] === anio) && (!filtraDep || tabla.dep[i] === codigoDep);
+            };
+            return [figuraMapa(datos, pasa, filtraDep, nivel, anio + '|' + departamento), nivel];
+        }
+    }
+});
+
+// Gráfico de barras: top 10 municipios
+function figuraBarras(datos, pasa, sufijo) {
+    var tabla = datos.mapa || datos.municipal;
+    var totales = {};
+    for (var i = 0; i < tabla.total.length; i++) {
+        if (pasa(tabla, i)) {
+            totales[tabla.mun[i]] = (totales[tabla.mun[i]] || 0) + tabla.total[i];
+        }
+    }
+    var top = Object.keys(totales).map(Number).sort(function(a, b) {
+        return totales[b] - totales[a] || a - b;
+    }).slice(0, 10);
+    return {
+        data: [{
+            type: 'bar',
+            x: top.map(function(c) { return datos.municipios[c]; }),
+            y: top.map(function(c) { return totales[c]; }),
+            marker: {color: datos.colores.primario},
+            hovertemplate: 'Municipio=%{x}<br>Cantidad de conversiones=%{y}<extra></extra>'
+        }],
+        layout: {
+            template: datos.plantilla,
+            title: {text: 'Top 10 municipios por conversiones' + sufijo, font: {size: 14}},
+            xaxis: {title: {text: 'Municipio'}, categoryorder: 'total descending', tickangle: -45},
+            yaxis: {title: {text: 'Cantidad de conversiones'}},
+            margin: {l: 40, r: 20, t: 50, b: 80}
+        }
+    };
+}
+
+// Mapa: un solo trazo con una burbuja por departamento (en su centroide) o por
+// municipio según el nivel, coloreada por departamento como en el servidor.
+// uirevision conserva el zoom del usuario al cambiar de nivel con el mismo filtro.
+function figuraMapa(datos, pasa, filtraDep, nivel, revision) {
+    if (!datos.mapa) {
+        return {
+            data: [],
+            layout: {
+                title: {text: 'Distribución geográfica - Datos no disponibles', font: {size: 14}},
+                annotations: [{text: 'No hay datos geográficos disponibles', xref: 'paper', yref: 'paper',
+                               x: 0.5, y: 0.5, showarrow: false}]
+            }
+        };
+    }
+    var tabla = datos.mapa;
+    var porMunicipio = nivel === 'municipios';
+    var puntos = {};
+    var orden = [];
+    for (var i = 0; i < tabla.total.length; i++) {
+        if (!pasa(tabla, i) || (!porMunicipio && tabla.dep[i] < 0)) {
+            continue;
+        }
+        var clave = porMunicipio ? tabla.dep[i] + '|' + tabla.mun[i] : tabla.dep[i];
+        if (!puntos[clave]) {
+            puntos[clave] = {dep: tabla.dep[i], mun: tabla.mun[i], total: 0, lat: tabla.lat[i], lon: tabla.lon[i]};
+            orden.push(clave);
+        }
+        puntos[clave].total += tabla.total[i];
+    }
+    if (!porMunicipio) {
+        // Departamentos en el orden de sus códigos, ubicados en su centroide
+        orden.sort(function(a, b) { return a - b; });
+        orden = orden.filter(function(dep) {
+            puntos[dep].lat = datos.centroides.lat[dep];
+            puntos[dep].lon = datos.centroides.lon[dep];
+            return puntos[dep].lat !== null && puntos[dep].total > 0;
+        });
+    }
+    var paleta = datos.secuencia_colores;
+    var trazo = {lat: [], lon: [], size: [], text: [], customdata: [], color: []};
+    var maximo = 0;
+    orden.forEach(function(clave) {
+        var p = puntos[clave];
+        var nombreDep = datos.departamentos[p.dep];
+        maximo = Math.max(maximo, p.total);
+        trazo.lat.push(p.lat);
+        trazo.lon.push(p.lon);
+        trazo.size.push(p.total);
+        trazo.text.push(porMunicipio ? datos.municipios[p.mun] : nombreDep);
+        trazo.customdata.push([nombreDep, p.total]);
+        trazo.color.push(paleta[((p.dep % paleta.length) + paleta.length) % paleta.length]);
+    });
+    // Con un departamento elegido el mapa se centra en sus municipios
+    var centro = {lat: 4.5709, lon: -74.2973};
+    if (filtraDep && trazo.lat.length) {
+        var suma = function(valores) { return valores.reduce(function(a, b) { return a + b; }, 0); };
+        centro = {lat: suma(trazo.lat) / trazo.lat.length, lon: suma(trazo.lon) / trazo.lon.length};
+    }
+    return {
+        data: [{
+            type: 'scattermapbox',
+            mode: 'markers',
+            showlegend: false,
+            lat: trazo.lat,
+            lon: trazo.lon,
+            hovertext: trazo.text,
+            customdata: trazo.customdata,
+            hovertemplate: '<b>%{hovertext}</b><br><br>DEPARTAMENTO_INSTALACION=%{customdata[0]}<br>' +
+                           'TOTAL_CONVERSIONES=%{customdata[1]}<extra></extra>',
+            marker: {
+                color: trazo.color,
+                size: trazo.size,
+                sizemode: 'area',
+                sizeref: maximo > 0 ? 2 * maximo / 400 : 1
+            },
+            subplot: 'mapbox'
+        }],
+        layout: {
+            template: datos.plantilla,
+            title: {text: 'Distribución geográfica de conversiones GNCV', font: {size: 14}},
+            mapbox: {style: 'carto-positron', zoom: filtraDep ? 6 : 4, center: centro},
+            margin: {l: 0, r: 0, t: 50, b: 0},
+            uirevision: revision
+        }
+    };
+}
+
+// Gráfico por tipo de vehículo, o por año si no existe la columna
+function figuraTipo(datos, pasa) {
+    var layout = {template: datos.plantilla, margin: {l: 20, r: 20, t: 50, b: 20}};
+    if (datos.tipos) {
+        var tabla = datos.tipos;
+        var totales = {};
+        for (var i = 0; i < tabla.total.length; i++) {
+            if (pasa(tabla, i)) {
+                totales[tabla.tipo[i]] = (totales[tabla.tipo[i]] || 0) + tabla.total[i];
+            }
+        }
+        var tipos = Object.keys(totales).map(Number).sort(function(a, b) { return totales[b] - totales[a]; });
+        layout.title = {text: 'Distribución por Tipo de Vehículo', font: {size: 14}};
+        return {
+            data: [{
+                type: 'pie',
+                labels: tipos.map(function(t) { return tabla.nombres[t]; }),
+                values: tipos.map(function(t) { return totales[t]; }),
+                hole: 0.4
+            }],
+            layout: layout
+        };
+    }
+    var mensual = datos.mensual;
+    var porAnio = {};
+    for (var j = 0; j < mensual.total.length; j++) {
+        if (pasa(mensual, j)) {
+            porAnio[mensual.anio[j]] = (porAnio[mensual.anio[j]] || 0) + mensual.total[j];
+        }
+    }
+    var anios = Object.keys(porAnio).map(Number).sort(function(a, b) { return a - b; });
+    layout.title = {text: 'Conversiones por Año', font: {size: 14}};
+    layout.xaxis = {title: {text: 'Año'}};
+    layout.yaxis = {title: {text: 'Cantidad de conversiones'}};
+    return {
+        data: [{
+            type: 'bar',
+            x: anios,
+            y: anios.map(function(a) { return porAnio[a]; }),
+            marker: {color: datos.colores.secundario},
+            hovertemplate: 'Año=%{x}<br>Cantidad de conversiones=%{y}<extra></extra>'
+        }],
+        layout: layout
+    };
+}
+
+// Gráfico de tendencia desde las series mensuales precalculadas en el servidor
+// (meses calendario consecutivos, promedios de GNCV_VENTANAS_MOVILES y variación
+// anual). Se corta igual que cortar_serie: fila del departamento o nacional,
+// meses del año elegido y sin los meses vacíos de los extremos.
+function figuraTendencia(datos, anio, filtraDep, codigoDep, sufijo) {
+    var series = datos.series;
+    var fila = filtraDep ? codigoDep + 1 : 0;
+    var inicio = 0;
+    var fin = 0;
+    if (series && (!filtraDep || codigoDep >= 0)) {
+        var conteos = series.conteos[fila];
+        fin = conteos.length;
+        if (anio !== null) {
+            var primerMes = (anio - 1970) * 12 - series.inicio;
+            inicio = Math.min(Math.max(primerMes, 0), fin);
+            fin = Math.min(Math.max(primerMes + 12, 0), fin);
+        }
+        while (inicio < fin && !conteos[inicio]) {
+            inicio++;
+        }
+        while (fin > inicio && !conteos[fin - 1]) {
+            fin--;
+        }
+    }
+    var fechas = [];
+    for (var k = inicio; k < fin; k++) {
+        var mes = series.inicio + k;
+        var mesTexto = String(mes % 12 + 1);
+        fechas.push((Math.floor(mes / 12) + 1970) + '-' + (mesTexto.length < 2 ? '0' + mesTexto : mesTexto) + '-01');
+    }
+    var data = [{
+        type: 'scatter',
+        mode: 'lines',
+        x: fechas,
+        y: fin > inicio ? series.conteos[fila].slice(inicio, fin) : [],
+        line: {dash: 'solid'},
+        showlegend: false,
+        hovertemplate: 'Fecha=%{x}<br>Cantidad de Conversiones=%{y}<extra></extra>'
+    }];
+    if (fin > inicio) {
+        data[0].customdata = series.variacion[fila].slice(inicio, fin);
+        data[0].hovertemplate = 'Fecha=%{x}<br>Cantidad de Conversiones=%{y}<br>' +
+                                'Variación anual=%{customdata:+.1%}<extra></extra>';
+    }
+    if (fin - inicio > 3) {
+        var ventanas = Object.keys(series.promedios).map(Number).sort(function(a, b) { return a - b; });
+        ventanas.forEach(function(ventana, i) {
+            var paleta = datos.secuencia_colores;
+            data.push({
+                type: 'scatter',
+                mode: 'lines',
+                x: fechas,
+                y: series.promedios[ventana][fila].slice(inicio, fin),
+                name: 'Promedio móvil (' + ventana + ' meses)',
+                line: {color: i === 0 ? datos.colores.resalte : paleta[(i + 1) % paleta.length],
+                       width: 2, dash: i === 0 ? 'dash' : 'dot'}
+            });
+        });
+    }
+    var titulo = sufijo ? 'Tendencia de Conversiones' + sufijo : 'Tendencia de Conversiones a lo Largo del Tiempo';
+    return {
+        data: data,
+        layout: {
+            template: datos.plantilla,
+            title: {text: titulo, font: {size: 16}},
+            xaxis: {title: {text: 'Fecha'}, tickangle: -45},
+            yaxis: {title: {text: 'Cantidad de Conversiones'}},
+            legend: {tracegroupgap: 0, orientation: 'h', yanchor: 'bottom', y: 1.02, xanchor: 'right', x: 1},
+            margin: {l: 40, r: 40, t: 60, b: 40}
+        }
+    };
+}
@@ -0,0 +1,260 @@
+# Benchmark del dashboard GNCV sobre datasets sintéticos.
+#
+# Genera tablas de conversiones con distribuciones realistas de departamento,
+# municipio, año y mes, y para cada tamaño mide en un proceso nuevo:
+#   - importación de app.py en frío (construye el almacén columnar) y en caliente
+#   - preprocesar_datos sobre el dataset cargado
+#   - actualizar_graficos y actualizar_tendencia sobre una matriz de filtros
+#   - intersección de filtros de detalle en el índice de bitmaps
+#   - RSS máximo del proceso
+# Los resultados se guardan en JSON para comparar entre versiones.
+#
+# Uso:
+#   python benchmark.py                              # 10k, 1M y 10M filas
+#   python benchmark.py --tamanos 10000 200000 --salida resultados.json
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+DIRECTORIO_APP = os.path.dirname(os.path.abspath(__file__))
+
+# Departamentos con sus municipios principales y coordenadas aproximadas. El
+# peso relativo imita la concentración real de conversiones (Bogotá, Valle,
+# Antioquia y Atlántico concentran la mayoría).
+DEPARTAMENTOS = {
+    'BOGOTA D.C.': (30.0, [('BOGOTA D.C.', 4.61, -74.08)]),
+    'VALLE DEL CAUCA': (14.0, [('CALI', 3.45, -76.53), ('PALMIRA', 3.54, -76.30), ('TULUA', 4.08, -76.20), ('BUGA', 3.90, -76.30)]),
+    'ANTIOQUIA': (13.0, [('MEDELLIN', 6.25, -75.56), ('BELLO', 6.34, -75.56), ('ITAGUI', 6.18, -75.60), ('ENVIGADO', 6.17, -75.59)]),
+    'ATLANTICO': (10.0, [('BARRANQUILLA', 10.96, -74.80), ('SOLEDAD', 10.92, -74.77), ('MALAMBO', 10.86, -74.77)]),
+    'CUNDINAMARCA': (6.0, [('SOACHA', 4.58, -74.22), ('CHIA', 4.86, -74.06), ('ZIPAQUIRA', 5.02, -74.00), ('FUSAGASUGA', 4.34, -74.36)]),
+    'SANTANDER': (5.0, [('BUCARAMANGA', 7.12, -73.12), ('FLORIDABLANCA', 7.06, -73.09), ('GIRON', 7.07, -73.17)]),
+    'BOLIVAR': (4.0, [('CARTAGENA', 10.39, -75.51), ('MAGANGUE', 9.24, -74.75)]),
+    'RISARALDA': (2.5, [('PEREIRA', 4.81, -75.69), ('DOSQUEBRADAS', 4.84, -75.67)]),
+    'TOLIMA': (2.0, [('IBAGUE', 4.44, -75.23), ('ESPINAL', 4.15, -74.88)]),
+    'META': (2.0, [('VILLAVICENCIO', 4.14, -73.63), ('ACACIAS', 3.99, -73.76)]),
+    'CALDAS': (1.5, [('MANIZALES', 5.07, -75.52)]),
+    'HUILA': (1.5, [('NEIVA', 2.93, -75.28), ('PITALITO', 1.85, -76.05)]),
+    'NORTE DE SANTANDER': (1.5, [('CUCUTA', 7.89, -72.50)]),
+    'MAGDALENA': (1.2, [('SANTA MARTA', 11.24, -74.20)]),
+    'CORDOBA': (1.0, [('MONTERIA', 8.75, -75.88)]),
+    'BOYACA': (1.0, [('TUNJA', 5.54, -73.36), ('DUITAMA', 5.83, -73.03), ('SOGAMOSO', 5.71, -72.93)]),
+    'QUINDIO': (0.8, [('ARMENIA', 4.53, -75.68)]),
+    'CESAR': (0.8, [('VALLEDUPAR', 10.46, -73.25)]),
+    'SUCRE': (0.6, [('SINCELEJO', 9.30, -75.40)]),
+    'NARIÑO': (0.5, [('PASTO', 1.21, -77.28)]),
+    'CAUCA': (0.5, [('POPAYAN', 2.44, -76.61)]),
+    'LA GUAJIRA': (0.3, [('RIOHACHA', 11.54, -72.91)]),
+    'CASANARE': (0.3, [('YOPAL', 5.34, -72.39)]),
+}
+# Municipios adicionales por departamento para llegar a un orden de magnitud
+# parecido al real (~1.100 municipios)
+MUNICIPIOS_EXTRA_POR_DEPARTAMENTO = 45
+
+ANIO_INICIAL = 2005
+ANIO_FINAL = 2024
+TIPOS_VEHICULO = ['AUTOMOVIL', 'TAXI', 'CAMIONETA', 'CAMPERO', 'BUS', 'MICROBUS']
+PESOS_TIPO = [0.35, 0.30, 0.15, 0.10, 0.05, 0.05]
+
+# Función que arma el catálogo de municipios con pesos tipo Zipf dentro de cada departamento
+def catalogo_municipios(rng):
+    filas = []
+    for departamento, (peso_dep, principales) in DEPARTAMENTOS.items():
+        lat0, lon0 = principales[0][1], principales[0][2]
+        municipios = list(principales)
+        for i in range(MUNICIPIOS_EXTRA_POR_DEPARTAMENTO):
+            municipios.append((f'{departamento} MPIO {i + 1:03d}', lat0 + rng.normal(0, 0.6), lon0 + rng.normal(0, 0.6)))
+        pesos = 1.0 / np.arange(1, len(municipios) + 1) ** 1.2
+        pesos = peso_dep * pesos / pesos.sum()
+        for (municipio, lat, lon), peso in zip(municipios, pesos):
+            filas.append((departamento, municipio, lat, lon, peso))
+    catalogo = pd.DataFrame(filas, columns=['DEPARTAMENTO_INSTALACION', 'MUNICIPIO_INSTALACION',
+                                            'LATITUD_MUNICIPIO', 'LONGITUD_MUNICIPIO', 'PESO'])
+    catalogo['PESO'] /= catalogo['PESO'].sum()
+    return catalogo
+
+# Función que escribe un CSV sintético de n filas por bloques (para no agotar memoria en 10M)
+def generar_dataset(ruta, filas, semilla=0, tamano_bloque=1_000_000):
+    rng = np.random.default_rng(semilla)
+    catalogo = catalogo_municipios(rng)
+    anios = np.arange(ANIO_INICIAL, ANIO_FINAL + 1)
+    # Crecimiento sostenido con caída en 2020
+    pesos_anio = np.linspace(1.0, 3.0, len(anios))
+    pesos_anio[anios == 2020] *= 0.6
+    pesos_anio /= pesos_anio.sum()
+    # Estacionalidad leve: más conversiones a mitad y final de año
+    pesos_mes = 1.0 + 0.15 * np.sin(np.linspace(0, 2 * np.pi, 12, endpoint=False) - np.pi / 2) ** 2
+    pesos_mes /= pesos_mes.sum()
+
+    escritas = 0
+    while escritas < filas:
+        n = min(tamano_bloque, filas - escritas)
+        idx = rng.choice(len(catalogo), size=n, p=catalogo['PESO'].to_numpy())
+        bloque = catalogo.iloc[idx, :4].reset_index(drop=True)
+        bloque['ANIO_INSTALACION'] = rng.choice(anios, size=n, p=pesos_anio)
+        bloque['MES_INSTALACION'] = rng.choice(np.arange(1, 13), size=n, p=pesos_mes)
+        bloque['TIPO_VEHICULO'] = rng.choice(TIPOS_VEHICULO, size=n, p=PESOS_TIPO)
+        bloque = bloque[['DEPARTAMENTO_INSTALACION', 'MUNICIPIO_INSTALACION', 'ANIO_INSTALACION', 'MES_INSTALACION',
+                         'LATITUD_MUNICIPIO', 'LONGITUD_MUNICIPIO', 'TIPO_VEHICULO']]
+        bloque.to_csv(ruta, mode='w' if escritas == 0 else 'a', header=escritas == 0, index=False, float_format='%.5f')
+        escritas += n
+
+# Función para medir el tiempo de una llamada en milisegundos
+def cronometrar(funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    return (time.perf_counter() - inicio) * 1000, resultado
+
+# Función para resumir una lista de tiempos
+def resumen(tiempos):
+    tiempos = np.asarray(tiempos)
+    return {
+        'n': int(len(tiempos)),
+        'media_ms': float(tiempos.mean()),
+        'p50_ms': float(np.percentile(tiempos, 50)),
+        'p95_ms': float(np.percentile(tiempos, 95)),
+        'max_ms': float(tiempos.max())
+    }
+
+# Función para leer el RSS máximo del proceso en MB
+def rss_maximo_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+# Medición dentro del proceso hijo: se ejecuta con el directorio de trabajo del dataset
+def medir(repeticiones):
+    sys.path.insert(0, DIRECTORIO_APP)
+    tiempo_import, app = cronometrar(__import__, 'app')
+    rss_import = rss_maximo_mb()
+
+    estado = app.estado_datos
+    # Se preprocesa el dataframe crudo (tal como sale del almacén columnar) igual
+    # que al arrancar la app, sin derivar fechas ni trimestres
+    crudo, _ = app.cargar_datos(app.RUTA_CSV)
+    tiempo_preprocesar, _ = cronometrar(app.preprocesar_datos, crudo, False)
+    del crudo
+
+    # Matriz de filtros: todos los años y los departamentos más grandes, más 'todos'
+    anios = ['todos'] + estado['anios']
+    departamentos = ['todos'] + estado['departamentos'][:8]
+    tiempos_graficos, tiempos_tendencia = [], []
+    for _ in range(repeticiones):
+        for anio in anios:
+            for departamento in departamentos:
+                cubo_filtrado = app.filtrar_cubo(estado['cubo'], estado['indice_cubo'], anio, departamento)
+                t, _ = cronometrar(app.actualizar_graficos, estado, cubo_filtrado, anio, departamento)
+                tiempos_graficos.append(t)
+                t, _ = cronometrar(app.actualizar_tendencia, estado, anio, departamento)
+                tiempos_tendencia.append(t)
+
+    # Filtros de detalle: combinaciones aleatorias intersectadas en el índice de bitmaps
+    rng = np.random.default_rng(0)
+    tiempos_bitmap = []
+    for _ in range(200 * repeticiones):
+        mes_inicio, mes_fin = sorted(rng.integers(1, 13, 2).tolist())
+        consulta = app.normalizar_consulta(
+            anios[rng.integers(len(anios))],
+            rng.choice(estado['departamentos'], rng.integers(0, 4), replace=False).tolist(),
+            rng.choice(estado['municipios'], rng.integers(0, 3), replace=False).tolist(),
+            [mes_inicio, mes_fin],
+            rng.choice(estado['tipos'], rng.integers(0, 2), replace=False).tolist() if estado['tipos'] else []
+        )
+        t, _ = cronometrar(estado['indice_bitmap'].filtrar, consulta)
+        tiempos_bitmap.append(t)
+
+    return {
+        'import_ms': tiempo_import,
+        'preprocesar_datos_ms': tiempo_preprocesar,
+        'actualizar_graficos': resumen(tiempos_graficos),
+        'actualizar_tendencia': resumen(tiempos_tendencia),
+        'filtrar_bitmap': resumen(tiempos_bitmap),
+        'combinaciones_filtro': len(anios) * len(departamentos),
+        'filas': int(estado['kpis']['total_conversiones']),
+        'grupos_cubo': int(len(estado['cubo'])),
+        'rss_import_mb': rss_import,
+        'rss_maximo_mb': rss_maximo_mb()
+    }
+
+# Función que lanza la medición en un proceso nuevo y devuelve su resultado
+def medir_en_subproceso(directorio, repeticiones):
+    # Sin precalentamiento (sus hilos renderizarían durante los ciclos medidos) ni
+    # precompresión de assets al importar: solo se mide el trabajo del dashboard
+    entorno = dict(os.environ, GNCV_INTERVALO_RECARGA='0', GNCV_CACHE_DIR='', GNCV_MODO_CLIENTE='0',
+                   GNCV_PRECALENTAR='0', GNCV_COMPRESION='0',
+                   GNCV_COLUMNAR_DIR=os.path.join(directorio, '.gncv_columnar'))
+    salida = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--medir', '--repeticiones', str(repeticiones)],
+        cwd=directorio, env=entorno, capture_output=True, text=True, check=True
+    )
+    # La última línea es el JSON; lo anterior son mensajes de la app
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del dashboard GNCV sobre datasets sintéticos')
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--salida', default='benchmark_resultados.json')
+    parser.add_argument('--directorio', default=None, help='Directorio de trabajo (por defecto uno temporal)')
+    parser.add_argument('--conservar', action='store_true', help='No borrar los datasets generados')
+    parser.add_argument('--medir', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        print(json.dumps(medir(args.repeticiones)))
+        return
+
+    base = args.directorio or tempfile.mkdtemp(prefix='gncv_bench_')
+    resultados = {
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'plataforma': platform.platform(),
+        'corridas': []
+    }
+    try:
+        for filas in args.tamanos:
+            directorio = os.path.join(base, f'filas_{filas}')
+            os.makedirs(directorio, exist_ok=True)
+            ruta = os.path.join(directorio, 'Database.csv')
+            print(f'Generando {filas:,} filas...', flush=True)
+            tiempo_generar, _ = cronometrar(generar_dataset, ruta, filas)
+
+            print('  arranque en frío...', flush=True)
+            frio = medir_en_subproceso(directorio, args.repeticiones)
+            print('  arranque en caliente...', flush=True)
+            caliente = medir_en_subproceso(directorio, args.repeticiones)
+
+            corrida = {
+                'filas': filas,
+                'tamano_csv_mb': os.path.getsize(ruta) / (1024 * 1024),
+                'generar_ms': tiempo_generar,
+                'frio': frio,
+                'caliente': caliente
+            }
+            resultados['corridas'].append(corrida)
+            print(f"  import frío {frio['import_ms']:.0f} ms, caliente {caliente['import_ms']:.0f} ms, "
+                  f"graficos p95 {caliente['actualizar_graficos']['p95_ms']:.1f} ms, "
+                  f"tendencia p95 {caliente['actualizar_tendencia']['p95_ms']:.1f} ms, "
+                  f"bitmap p95 {caliente['filtrar_bitmap']['p95_ms']:.3f} ms, "
+                  f"RSS {caliente['rss_maximo_mb']:.0f} MB", flush=True)
+    finally:
+        if not args.conservar and args.directorio is None:
+            shutil.rmtree(base, ignore_errors=True)
+
+    with open(args.salida, 'w', encoding='utf-8') as archivo:
+        json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+    print(f'Resultados guardados en {args.salida}')
+
+if __name__ == '__main__':
+    main()